@@ -0,0 +1,96 @@
+"""Compare latency of token checks over REST and gRPC.
+
+Usage:
+    python benchmarks/token_check.py --login admin --password admin1 --requests 2000 --concurrency 10
+
+Requires running auth API (wsgi) and grpc_server.py.
+"""
+import argparse
+import statistics
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Iterator
+
+import grpc
+import requests
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from grpc_api import token_check_pb2, token_check_pb2_grpc  # noqa: E402
+
+
+def get_access_token(api_url: str, login: str, password: str) -> str:
+    response = requests.post(f"{api_url}/api/v1/users/login", json={"login": login, "password": password})
+    response.raise_for_status()
+    return response.json()["token"]["access_token"]
+
+
+def measure(name: str, call: Callable[[], None], total: int, concurrency: int) -> None:
+    def timed(_: int) -> float:
+        start = perf_counter()
+        call()
+        return perf_counter() - start
+
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(timed, range(total)))
+    elapsed = perf_counter() - started
+    print(
+        "{0:<12} {1:>8.0f} req/s  p50 {2:>7.2f} ms  p99 {3:>7.2f} ms".format(
+            name,
+            total / elapsed,
+            statistics.median(latencies) * 1000,
+            latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        )
+    )
+
+
+def measure_stream(stub: token_check_pb2_grpc.TokenCheckStub, access_token: str, total: int) -> None:
+    def requests_iterator() -> Iterator[token_check_pb2.CheckTokenRequest]:
+        for _ in range(total):
+            yield token_check_pb2.CheckTokenRequest(access_token=access_token)
+
+    started = perf_counter()
+    for _ in stub.CheckTokenStream(requests_iterator()):
+        pass
+    elapsed = perf_counter() - started
+    print("{0:<12} {1:>8.0f} req/s".format("grpc stream", total / elapsed))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--grpc-target", default="127.0.0.1:50051")
+    parser.add_argument("--login", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    access_token = get_access_token(args.api_url, args.login, args.password)
+    headers = {"X-Request-Id": "benchmark", "X-Real-IP": "127.0.0.1"}
+
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+    def rest_call() -> None:
+        response = session.post(
+            f"{args.api_url}/api/v1/roles/user/check", json={"access_token": access_token}, headers=headers
+        )
+        response.raise_for_status()
+
+    channel = grpc.insecure_channel(args.grpc_target)
+    stub = token_check_pb2_grpc.TokenCheckStub(channel)
+
+    def grpc_call() -> None:
+        stub.CheckToken(token_check_pb2.CheckTokenRequest(access_token=access_token))
+
+    measure("rest", rest_call, args.requests, args.concurrency)
+    measure("grpc unary", grpc_call, args.requests, args.concurrency)
+    measure_stream(stub, access_token, args.requests)
+
+
+if __name__ == "__main__":
+    main()
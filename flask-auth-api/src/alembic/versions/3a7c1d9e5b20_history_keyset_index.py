@@ -0,0 +1,26 @@
+"""history keyset index
+
+Revision ID: 3a7c1d9e5b20
+Revises: e885b2d87645
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3a7c1d9e5b20"
+down_revision = "e885b2d87645"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_users_access_history_user_id_login_date_id",
+        "users_access_history",
+        ["user_id", "login_date", "id"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_users_access_history_user_id_login_date_id", table_name="users_access_history")
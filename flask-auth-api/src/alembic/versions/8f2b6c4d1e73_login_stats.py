@@ -0,0 +1,48 @@
+"""login stats
+
+Revision ID: 8f2b6c4d1e73
+Revises: 3a7c1d9e5b20
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8f2b6c4d1e73"
+down_revision = "3a7c1d9e5b20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "login_stats",
+        sa.Column("bucket", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("service_name", sa.String(), nullable=False),
+        sa.Column("login_status", sa.Boolean(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("bucket", "user_id", "service_name", "login_status"),
+    )
+    op.create_index("ix_login_stats_user_id_bucket", "login_stats", ["user_id", "bucket"])
+    op.execute(
+        """
+        INSERT INTO login_stats (bucket, user_id, service_name, login_status, count)
+        SELECT date_trunc('hour', login_date), user_id, coalesce(service_name, 'password'), login_status, count(*)
+        FROM users_access_history
+        WHERE user_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("ix_login_stats_user_id_bucket", table_name="login_stats")
+    op.drop_table("login_stats")
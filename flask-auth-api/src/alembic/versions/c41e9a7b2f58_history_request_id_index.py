@@ -0,0 +1,26 @@
+"""history request_id index
+
+Revision ID: c41e9a7b2f58
+Revises: 8f2b6c4d1e73
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c41e9a7b2f58"
+down_revision = "8f2b6c4d1e73"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_users_access_history_request_id_login_date",
+        "users_access_history",
+        ["request_id", "login_date"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_users_access_history_request_id_login_date", table_name="users_access_history")
@@ -10,16 +10,21 @@ from api.v1.common_view import CustomSwaggerView
 from containers.container import Container
 from core.msg import Msg
 from models.users_response_schemas import (
+    BulkUserRoleSchema,
     CheckAccessTokenSchema,
+    CheckAccessTokensSchema,
     MsgSchema,
+    RoleAssignmentSchema,
+    RoleConflictSchema,
     RoleSchema,
     RoleUUIDSchema,
+    TokenCheckSchema,
     UserRoleSchema,
     UserUUIDSchema,
 )
 from services.roles import RoleService
 from services.users import RoleUserService
-from utils.exceptions import InvalidTokenError
+from utils.exceptions import InvalidTokenError, ObjectDoesNotExistError
 from utils.view_decorators import jwt_verification, revoked_token_check
 
 bp = Blueprint("roles", __name__, url_prefix="/api/v1/roles")
@@ -50,8 +55,8 @@ class Role(CustomSwaggerView):
             "description": HTTPStatus.CONFLICT.phrase,
             "content": {
                 "application/json": {
-                    "schema": MsgSchema,
-                    "example": Msg.alredy_exists.value,
+                    "schema": RoleConflictSchema,
+                    "example": {**Msg.alredy_exists.value, "conflicts": ["role1"]},
                 }
             },
         },
@@ -78,10 +83,14 @@ class Role(CustomSwaggerView):
     ) -> Response:
         self.validate_body(RoleSchema, many=True)
 
-        created = role_service.create_roles(self.validated_body)
-        if not created:
+        conflicts = role_service.create_roles(self.validated_body)
+        if conflicts:
             return make_response(
-                jsonify(MsgSchema().load(Msg.alredy_exists.value)),
+                jsonify(
+                    RoleConflictSchema().load(
+                        {**Msg.alredy_exists.value, "conflicts": conflicts}
+                    )
+                ),
                 HTTPStatus.CONFLICT.value,
             )
         return make_response(
@@ -276,6 +285,81 @@ class UserRoles(CustomSwaggerView):
         )
 
 
+class BulkUserRoles(CustomSwaggerView):
+    decorators = [revoked_token_check(), jwt_verification(superuser_only=True)]
+
+    tags = ["roles"]
+
+    requestBody = {
+        "content": {
+            "application/json": {
+                "schema": BulkUserRoleSchema,
+                "example": {"user_id": [], "role_id": []},
+            },
+        },
+    }
+
+    responses = {
+        HTTPStatus.OK.value: {
+            "description": HTTPStatus.OK.phrase,
+            "content": {
+                "application/json": {
+                    "schema": RoleAssignmentSchema,
+                    "example": {"users": 2, "updated": 1},
+                }
+            },
+        },
+        HTTPStatus.UNAUTHORIZED.value: {
+            "description": HTTPStatus.UNAUTHORIZED.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.unauthorized.value,
+                }
+            },
+        },
+        HTTPStatus.NOT_FOUND.value: {
+            "description": HTTPStatus.NOT_FOUND.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.not_found.value,
+                }
+            },
+        },
+    }
+
+    @inject
+    def post(
+        self, user_service: RoleUserService = Provide[Container.role_user_service]
+    ) -> Response:
+        return self._assign_roles(user_service, remove=False)
+
+    @inject
+    def delete(
+        self, user_service: RoleUserService = Provide[Container.role_user_service]
+    ) -> Response:
+        return self._assign_roles(user_service, remove=True)
+
+    def _assign_roles(self, user_service: RoleUserService, remove: bool) -> Response:
+        self.validate_body(BulkUserRoleSchema)
+        try:
+            assignment = user_service.assign_roles_to_users(
+                self.validated_body["user_id"],
+                self.validated_body["role_id"],
+                remove=remove,
+            )
+        except ObjectDoesNotExistError:
+            return make_response(
+                jsonify(MsgSchema().load(Msg.not_found.value)),
+                HTTPStatus.NOT_FOUND.value,
+            )
+
+        return make_response(
+            jsonify(RoleAssignmentSchema().dump(assignment)), HTTPStatus.OK.value
+        )
+
+
 class CheckUserRole(CustomSwaggerView):
 
     tags = ["roles"]
@@ -332,6 +416,49 @@ class CheckUserRole(CustomSwaggerView):
         return make_response(jsonify(roles), HTTPStatus.OK.value)
 
 
+class CheckUserRoleBatch(CustomSwaggerView):
+
+    tags = ["roles"]
+
+    requestBody = {
+        "content": {
+            "application/json": {
+                "schema": CheckAccessTokensSchema,
+                "example": {"access_tokens": ["", ""]},
+            },
+        },
+    }
+
+    responses = {
+        HTTPStatus.OK.value: {
+            "description": HTTPStatus.OK.phrase,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": TokenCheckSchema},
+                    "example": [
+                        {"status": "valid", "roles": ["role1", "role2"]},
+                        {"status": "revoked", "roles": []},
+                        {"status": "invalid", "roles": []},
+                    ],
+                }
+            },
+        },
+    }
+
+    @inject
+    def post(
+        self, user_service: RoleUserService = Provide[Container.role_user_service]
+    ) -> Response:
+        self.validate_body(CheckAccessTokensSchema)
+
+        checks = user_service.check_many_user_roles(
+            self.validated_body["access_tokens"]
+        )
+        return make_response(
+            jsonify(TokenCheckSchema(many=True).dump(checks)), HTTPStatus.OK.value
+        )
+
+
 bp.add_url_rule("/", view_func=Role.as_view("role"), methods=["POST", "GET"])
 bp.add_url_rule(
     "/<uuid:role_id>",
@@ -343,6 +470,16 @@ bp.add_url_rule(
     view_func=UserRoles.as_view("user_role"),
     methods=["POST", "DELETE"],
 )
+bp.add_url_rule(
+    "/users",
+    view_func=BulkUserRoles.as_view("bulk_user_roles"),
+    methods=["POST", "DELETE"],
+)
 bp.add_url_rule(
     "/user/check", view_func=CheckUserRole.as_view("check_role"), methods=["POST"]
 )
+bp.add_url_rule(
+    "/user/check/batch",
+    view_func=CheckUserRoleBatch.as_view("check_role_batch"),
+    methods=["POST"],
+)
@@ -3,7 +3,15 @@ from http import HTTPStatus
 from uuid import UUID
 
 from dependency_injector.wiring import Provide, inject
-from flask import Blueprint, abort, jsonify, make_response, redirect, url_for
+from flask import (
+    Blueprint,
+    abort,
+    jsonify,
+    make_response,
+    redirect,
+    stream_with_context,
+    url_for,
+)
 from flask.views import MethodView
 from flask.wrappers import Response
 from flask_jwt_extended import get_jti, get_jwt, jwt_required
@@ -15,6 +23,9 @@ from models.users_response_schemas import (
     AllDevicesSchema,
     AuthSchema,
     DefaultPaginator,
+    HistoryExportQuerySchema,
+    LoginStatSchema,
+    LoginStatsQuerySchema,
     MsgSchema,
     ProvidersSchema,
     RequestIdSchema,
@@ -38,11 +49,13 @@ from social.providers import Providers
 from social.userdata import user_data_registry
 from utils.exceptions import (
     ConflictError,
+    HashingQueueFullError,
     LoginPasswordError,
     ObjectDoesNotExistError,
     ProviderAuthTokenError,
 )
-from utils.rate_limit import rate_limiting
+from utils.export import EXPORT_FORMATS
+from utils.rate_limit import RateLimitKey, rate_limiting
 from utils.tracing import tracing
 from utils.view_decorators import jwt_verification, revoked_token_check
 
@@ -86,6 +99,15 @@ class RegistrationView(CustomSwaggerView):
                 }
             },
         },
+        HTTPStatus.SERVICE_UNAVAILABLE.value: {
+            "description": HTTPStatus.SERVICE_UNAVAILABLE.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.service_unavailable.value,
+                }
+            },
+        },
     }
 
     @inject
@@ -94,9 +116,15 @@ class RegistrationView(CustomSwaggerView):
     ) -> Response:
         self.validate_body(AuthSchema)
 
-        user_id = user_service.create_user(
-            self.validated_body["login"], self.validated_body["password"]
-        )
+        try:
+            user_id = user_service.create_user(
+                self.validated_body["login"], self.validated_body["password"]
+            )
+        except HashingQueueFullError:
+            return make_response(
+                jsonify(MsgSchema().load(Msg.service_unavailable.value)),
+                HTTPStatus.SERVICE_UNAVAILABLE.value,
+            )
         if user_id is None:
             return make_response(
                 jsonify(MsgSchema().load(Msg.alredy_exists.value)),
@@ -109,6 +137,7 @@ class RegistrationView(CustomSwaggerView):
 
 
 class LoginView(CustomSwaggerView):
+    decorators = [rate_limiting(requests_limit=10, key=RateLimitKey.login)]
 
     tags = ["users"]
     requestBody = {
@@ -135,6 +164,24 @@ class LoginView(CustomSwaggerView):
                 }
             },
         },
+        HTTPStatus.SERVICE_UNAVAILABLE.value: {
+            "description": HTTPStatus.SERVICE_UNAVAILABLE.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.service_unavailable.value,
+                }
+            },
+        },
+        HTTPStatus.TOO_MANY_REQUESTS.value: {
+            "description": HTTPStatus.TOO_MANY_REQUESTS.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.rate_limit.value,
+                }
+            },
+        },
     }
 
     @inject
@@ -152,6 +199,11 @@ class LoginView(CustomSwaggerView):
                 jsonify(MsgSchema().load(Msg.unauthorized.value)),
                 HTTPStatus.UNAUTHORIZED.value,
             )
+        except HashingQueueFullError:
+            return make_response(
+                jsonify(MsgSchema().load(Msg.service_unavailable.value)),
+                HTTPStatus.SERVICE_UNAVAILABLE.value,
+            )
         return make_response(
             jsonify(RequestIdSchema().dump(request_id)),
             HTTPStatus.OK.value,
@@ -205,11 +257,14 @@ class RefreshView(CustomSwaggerView):
                 jsonify(MsgSchema().load(Msg.unauthorized.value)),
                 HTTPStatus.UNAUTHORIZED.value,
             )
+        # the epoch is read before the roles, see BaseUserService.generate_request_id
+        epoch = request_service.get_epoch(user)
+        roles = user_service.get_user_roles(user)
         return make_response(
             jsonify(
                 TokenSchema().dump(
                     request_service.generate_tokens(
-                        user, token["admin"], user_service.get_user_roles(user)
+                        user, token["admin"], roles, epoch=epoch
                     )
                 )
             ),
@@ -326,6 +381,15 @@ class ChangeUserView(CustomSwaggerView):
                 }
             },
         },
+        HTTPStatus.SERVICE_UNAVAILABLE.value: {
+            "description": HTTPStatus.SERVICE_UNAVAILABLE.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.service_unavailable.value,
+                }
+            },
+        },
     }
 
     @inject
@@ -351,6 +415,11 @@ class ChangeUserView(CustomSwaggerView):
                 jsonify(MsgSchema().load(Msg.alredy_exists.value)),
                 HTTPStatus.CONFLICT.value,
             )
+        except HashingQueueFullError:
+            return make_response(
+                jsonify(MsgSchema().load(Msg.service_unavailable.value)),
+                HTTPStatus.SERVICE_UNAVAILABLE.value,
+            )
         return make_response(
             jsonify(MsgSchema().load(Msg.ok.value)), HTTPStatus.OK.value
         )
@@ -481,9 +550,28 @@ class UserHistoryView(CustomSwaggerView):
                 "default": DefaultPaginator.page_items.value,
             },
         },
+        {
+            "in": "query",
+            "name": "cursor",
+            "description": "X-Next-Cursor header of the previous page, page_num is ignored",
+            "schema": {"type": "string"},
+        },
+        {
+            "in": "query",
+            "name": "from",
+            "description": "Start of the login date range, inclusive",
+            "schema": {"type": "string", "format": "date-time"},
+        },
+        {
+            "in": "query",
+            "name": "to",
+            "description": "End of the login date range, exclusive",
+            "schema": {"type": "string", "format": "date-time"},
+        },
         {
             "in": "query",
             "name": "year",
+            "description": "Month range year, used when from and to are not set",
             "schema": {
                 "type": "integer",
                 "default": datetime.now().year,
@@ -492,6 +580,7 @@ class UserHistoryView(CustomSwaggerView):
         {
             "in": "query",
             "name": "month",
+            "description": "Month range month, used when from and to are not set",
             "schema": {
                 "type": "integer",
                 "minimum": 1,
@@ -504,6 +593,12 @@ class UserHistoryView(CustomSwaggerView):
     responses = {
         HTTPStatus.OK.value: {
             "description": HTTPStatus.OK.phrase,
+            "headers": {
+                "X-Next-Cursor": {
+                    "description": "Cursor of the next page, absent on the last page",
+                    "schema": {"type": "string"},
+                },
+            },
             "content": {
                 "application/json": {
                     "schema": {"type": "array", "items": UserHistorySchema}
@@ -543,17 +638,201 @@ class UserHistoryView(CustomSwaggerView):
             user_id,
             self.validated_query.get("page_num", DefaultPaginator.page_num.value),
             self.validated_query.get("page_items", DefaultPaginator.page_items.value),
-            self.validated_query.get("year", datetime.now().year),
-            self.validated_query.get("month", datetime.now().month),
+            self.validated_query.get("date_from"),
+            self.validated_query.get("date_to"),
+            self.validated_query.get("cursor"),
         )
-        if not user_history:
+        if not user_history.items:
             return make_response(
                 jsonify(MsgSchema().load(Msg.not_found.value)),
                 HTTPStatus.NOT_FOUND.value,
             )
 
+        response = make_response(
+            jsonify(UserHistorySchema(many=True).dump(user_history.items)),
+            HTTPStatus.OK.value,
+        )
+        if user_history.next_cursor:
+            response.headers["X-Next-Cursor"] = user_history.next_cursor
+        return response
+
+
+class UserHistoryExportView(CustomSwaggerView):
+    decorators = [
+        rate_limiting(requests_limit=5, key=RateLimitKey.user),
+        revoked_token_check(),
+        jwt_verification(),
+    ]
+
+    tags = ["users"]
+    parameters = [
+        {
+            "in": "path",
+            "name": "user_id",
+            "schema": {"type": "string", "format": "uuid"},
+            "required": True,
+        },
+        {
+            "in": "query",
+            "name": "format",
+            "schema": {
+                "type": "string",
+                "enum": list(EXPORT_FORMATS),
+                "default": "ndjson",
+            },
+        },
+        {
+            "in": "query",
+            "name": "from",
+            "description": "Start of the login date range, inclusive",
+            "schema": {"type": "string", "format": "date-time"},
+        },
+        {
+            "in": "query",
+            "name": "to",
+            "description": "End of the login date range, exclusive",
+            "schema": {"type": "string", "format": "date-time"},
+        },
+    ]
+
+    responses = {
+        HTTPStatus.OK.value: {
+            "description": HTTPStatus.OK.phrase,
+            "content": {
+                "application/x-ndjson": {"schema": UserHistorySchema},
+                "text/csv": {"schema": {"type": "string"}},
+            },
+        },
+        HTTPStatus.UNAUTHORIZED.value: {
+            "description": HTTPStatus.UNAUTHORIZED.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.unauthorized.value,
+                }
+            },
+        },
+        HTTPStatus.TOO_MANY_REQUESTS.value: {
+            "description": HTTPStatus.TOO_MANY_REQUESTS.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.rate_limit.value,
+                }
+            },
+        },
+    }
+
+    @inject
+    def get(
+        self,
+        user_id: str,
+        user_service: HistoryUserService = Provide[Container.history_user_service],
+    ) -> Response:
+        self.validate_path(UserUUIDSchema)
+        self.validate_query(HistoryExportQuerySchema)
+
+        export_format = self.validated_query["format"]
+        lines = user_service.export_history(
+            self.validated_query.get("date_from"),
+            self.validated_query.get("date_to"),
+            export_format,
+            user_id=str(user_id),
+        )
+        return Response(
+            stream_with_context(lines),
+            mimetype=EXPORT_FORMATS[export_format],
+            headers={
+                "Content-Disposition": "attachment; filename=history-{0}.{1}".format(
+                    user_id, export_format
+                )
+            },
+        )
+
+
+class LoginStatsView(CustomSwaggerView):
+    decorators = [revoked_token_check(), jwt_verification(superuser_only=True)]
+
+    tags = ["users"]
+    parameters = [
+        {
+            "in": "query",
+            "name": "granularity",
+            "description": "Count per hour, per day or per login service for the whole range",
+            "schema": {
+                "type": "string",
+                "enum": ["hour", "day", "provider"],
+                "default": "day",
+            },
+        },
+        {
+            "in": "query",
+            "name": "from",
+            "description": "Start of the login date range, inclusive",
+            "schema": {"type": "string", "format": "date-time"},
+        },
+        {
+            "in": "query",
+            "name": "to",
+            "description": "End of the login date range, exclusive",
+            "schema": {"type": "string", "format": "date-time"},
+        },
+        {
+            "in": "query",
+            "name": "group_by",
+            "description": "Count per user as well",
+            "schema": {"type": "string", "enum": ["user_id"]},
+        },
+        {
+            "in": "query",
+            "name": "user_id",
+            "schema": {"type": "string", "format": "uuid"},
+        },
+        {
+            "in": "query",
+            "name": "login_status",
+            "schema": {"type": "boolean"},
+        },
+    ]
+
+    responses = {
+        HTTPStatus.OK.value: {
+            "description": HTTPStatus.OK.phrase,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": LoginStatSchema}
+                },
+            },
+        },
+        HTTPStatus.UNAUTHORIZED.value: {
+            "description": HTTPStatus.UNAUTHORIZED.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.unauthorized.value,
+                }
+            },
+        },
+    }
+
+    @inject
+    def get(
+        self,
+        user_service: HistoryUserService = Provide[Container.history_user_service],
+    ) -> Response:
+        self.validate_query(LoginStatsQuerySchema)
+
+        user_id = self.validated_query.get("user_id")
+        stats = user_service.get_login_stats(
+            self.validated_query["granularity"],
+            self.validated_query.get("date_from"),
+            self.validated_query.get("date_to"),
+            user_id=str(user_id) if user_id else None,
+            login_status=self.validated_query.get("login_status"),
+            group_by_user=self.validated_query.get("group_by") == "user_id",
+        )
         return make_response(
-            jsonify(UserHistorySchema(many=True).dump(user_history)),
+            jsonify(LoginStatSchema(many=True).dump(stats)),
             HTTPStatus.OK.value,
         )
 
@@ -584,6 +863,15 @@ class SocialLoginView(CustomSwaggerView):
                 }
             },
         },
+        HTTPStatus.SERVICE_UNAVAILABLE.value: {
+            "description": HTTPStatus.SERVICE_UNAVAILABLE.phrase,
+            "content": {
+                "application/json": {
+                    "schema": MsgSchema,
+                    "example": Msg.service_unavailable.value,
+                }
+            },
+        },
     }
 
     @inject
@@ -619,6 +907,11 @@ class SocialLoginView(CustomSwaggerView):
                 jsonify(MsgSchema().load(Msg.not_found.value)),
                 HTTPStatus.NOT_FOUND.value,
             )
+        except HashingQueueFullError:
+            return make_response(
+                jsonify(MsgSchema().load(Msg.service_unavailable.value)),
+                HTTPStatus.SERVICE_UNAVAILABLE.value,
+            )
 
         return make_response(
             jsonify(RequestIdSchema().dump(request_id)),
@@ -737,6 +1030,16 @@ bp.add_url_rule(
     view_func=UserHistoryView.as_view("history"),
     methods=["GET"],
 )
+bp.add_url_rule(
+    "/history/export/<uuid:user_id>",
+    view_func=UserHistoryExportView.as_view("history_export"),
+    methods=["GET"],
+)
+bp.add_url_rule(
+    "/stats",
+    view_func=LoginStatsView.as_view("login_stats"),
+    methods=["GET"],
+)
 bp.add_url_rule(
     "/verificate/<uuid:user_id>",
     view_func=UserVerificationView.as_view("verification"),
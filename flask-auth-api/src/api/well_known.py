@@ -0,0 +1,41 @@
+from http import HTTPStatus
+
+from flask import request
+from flask.blueprints import Blueprint
+from flask.helpers import make_response
+from flask.json import jsonify
+from flask.wrappers import Response
+
+from api.v1.common_view import CustomSwaggerView
+from core.config import config
+from utils.keys import keyring
+
+bp = Blueprint("well_known", __name__, url_prefix="/.well-known")
+
+
+class Jwks(CustomSwaggerView):
+
+    tags = ["keys"]
+
+    responses = {
+        HTTPStatus.OK.value: {
+            "description": HTTPStatus.OK.phrase,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "object"},
+                    "example": {"keys": [{"kty": "RSA", "kid": "20220601120000-9f86d081", "alg": "RS256", "use": "sig"}]},
+                }
+            },
+        },
+        HTTPStatus.NOT_MODIFIED.value: {"description": HTTPStatus.NOT_MODIFIED.phrase},
+    }
+
+    def get(self) -> Response:
+        response = make_response(jsonify(keyring.jwks()), HTTPStatus.OK.value)
+        response.cache_control.public = True
+        response.cache_control.max_age = config.jwks_max_age
+        response.add_etag()
+        return response.make_conditional(request)
+
+
+bp.add_url_rule("/jwks.json", view_func=Jwks.as_view("jwks"), methods=["GET"])
@@ -0,0 +1,19 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from utils.export import EXPORT_FORMATS
+
+history_cli = AppGroup("history")
+
+
+@history_cli.command("export")
+@click.option("--user-id", default=None, help="Export only this user's history")
+@click.option("--from", "date_from", type=click.DateTime(), default=None, help="Start of the range, inclusive")
+@click.option("--to", "date_to", type=click.DateTime(), default=None, help="End of the range, exclusive")
+@click.option("--format", "export_format", type=click.Choice(list(EXPORT_FORMATS)), default="ndjson")
+@click.option("--output", type=click.File("w"), default="-", help="Output file, stdout by default")
+def export_history(user_id, date_from, date_to, export_format, output):
+    user_service = current_app.container.history_user_service()  # type: ignore
+    for line in user_service.export_history(date_from, date_to, export_format, user_id=user_id):
+        output.write(line)
@@ -0,0 +1,21 @@
+import click
+from flask.cli import AppGroup
+
+from utils.keys import keyring
+
+keys_cli = AppGroup("jwks")
+
+
+@keys_cli.command("rotate")
+def rotate_keys():
+    key = keyring.generate()
+    print("Key {0} created, it will sign tokens in {1} seconds".format(key.kid, keyring.publish_ahead))
+
+
+@keys_cli.command("prune")
+@click.option("--dry-run", is_flag=True, default=False, help="Only list keys which can be removed")
+def prune_keys(dry_run):
+    for key in keyring.retired():
+        print("Key {0} retired".format(key.kid))
+        if not dry_run:
+            (keyring.keys_dir / "{0}.pem".format(key.kid)).unlink()
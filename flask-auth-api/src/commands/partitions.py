@@ -0,0 +1,29 @@
+from time import sleep
+
+import click
+from flask.cli import AppGroup
+
+from core.config import config, logger
+from db.db import Database
+from db.partitions import history_partitions
+
+partitions_cli = AppGroup("partitions")
+
+
+@partitions_cli.command("maintain")
+@click.option("--detach-only", is_flag=True, default=False, help="Detach expired partitions without dropping them")
+def maintain_partitions(detach_only):
+    history_partitions.run(Database().engine, detach_only)
+
+
+@partitions_cli.command("schedule")
+@click.option("--interval", default=config.history_maintenance_interval, help="Seconds between maintenance runs")
+@click.option("--detach-only", is_flag=True, default=False, help="Detach expired partitions without dropping them")
+def schedule_partitions(interval, detach_only):
+    engine = Database().engine
+    while True:
+        try:
+            history_partitions.run(engine, detach_only)
+        except Exception:
+            logger.exception("partition maintenance failed")
+        sleep(interval)
@@ -0,0 +1,28 @@
+from uuid import UUID
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from utils.exceptions import ObjectDoesNotExistError
+
+roles_cli = AppGroup("roles")
+
+
+@roles_cli.command("assign")
+@click.option("--users", "users_file", type=click.File("r"), default="-", help="File with a user id per line")
+@click.option("--role-id", "role_ids", type=click.UUID, multiple=True, required=True, help="Role to assign")
+@click.option("--remove", is_flag=True, default=False, help="Remove the roles instead of adding them")
+def assign_roles(users_file, role_ids, remove):
+    try:
+        user_ids = [UUID(line.strip()) for line in users_file if line.strip()]
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--users")
+
+    user_service = current_app.container.role_user_service()  # type: ignore
+    with click.progressbar(length=len(user_ids), label="Users", file=click.get_text_stream("stderr")) as progress:
+        try:
+            assignment = user_service.assign_roles_to_users(user_ids, list(role_ids), remove, progress.update)
+        except ObjectDoesNotExistError:
+            raise click.BadParameter("role does not exist", param_hint="--role-id")
+    print("Users: {0}, changed: {1}".format(assignment.users, assignment.updated))
@@ -0,0 +1,91 @@
+import csv
+import json
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, TextIO
+from uuid import UUID, uuid4
+
+import click
+from flask.cli import AppGroup
+
+from core.config import config
+from db.db import Database
+from db.users_copy import copy_users, export_users
+from utils.export import EXPORT_FORMATS
+from utils.password_hashing import is_password_hash
+
+users_cli = AppGroup("users")
+
+
+def read_rows(source: TextIO, import_format: str) -> Iterator[dict]:
+    if import_format == "csv":
+        yield from csv.DictReader(source)
+        return
+    for line in source:
+        if line.strip():
+            yield json.loads(line)
+
+
+def parse_user(row: dict) -> tuple:
+    login = str(row.get("login") or "").strip()
+    password = str(row.get("password") or "")
+    if not login:
+        raise ValueError("login is empty")
+    if not is_password_hash(password):
+        raise ValueError("password is not a hash of a known scheme")
+    user_id = UUID(str(row["id"])) if row.get("id") else uuid4()
+    is_superuser = str(row.get("is_superuser") or "").lower() in ("1", "t", "true", "yes")
+    return str(user_id), login, password, row.get("email") or None, is_superuser
+
+
+@users_cli.command("import")
+@click.option("--input", "source", type=click.File("r"), default="-", help="Input file, stdin by default")
+@click.option("--format", "import_format", type=click.Choice(list(EXPORT_FORMATS)), default="csv")
+@click.option("--batch-size", default=config.users_import_batch_size, help="Users loaded by one COPY")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), default=None, help="File to resume the import from")
+def import_users(source, import_format, batch_size, checkpoint):
+    """Load users with password hashes from CSV or NDJSON with id, login, password, email and
+    is_superuser fields. Existing users are skipped."""
+    checkpoint_path = Path(checkpoint) if checkpoint else None
+    done = int(checkpoint_path.read_text()) if checkpoint_path and checkpoint_path.exists() else 0
+    engine = Database().engine
+    read = inserted = rejected = 0
+    started = perf_counter()
+    batch: list[tuple] = []
+
+    def load_batch() -> None:
+        nonlocal inserted
+        inserted += copy_users(engine, batch)
+        batch.clear()
+        if checkpoint_path:
+            checkpoint_path.write_text(str(done + read))
+        click.echo(
+            "{0} rows read, {1} inserted, {2} rejected, {3:.0f} rows/s".format(
+                done + read, inserted, rejected, read / (perf_counter() - started)
+            ),
+            err=True,
+        )
+
+    for number, row in enumerate(read_rows(source, import_format), 1):
+        if number <= done:
+            continue
+        read += 1
+        try:
+            batch.append(parse_user(row))
+        except (KeyError, TypeError, ValueError) as error:
+            rejected += 1
+            click.echo("Row {0} rejected: {1}".format(number, error), err=True)
+        if read % batch_size == 0:
+            load_batch()
+    if read % batch_size:
+        load_batch()
+
+
+@users_cli.command("export")
+@click.option("--format", "export_format", type=click.Choice(list(EXPORT_FORMATS)), default="csv")
+@click.option("--output", type=click.File("w"), default="-", help="Output file, stdout by default")
+def export_users_command(export_format, output):
+    """Unload users with password hashes in the format users import reads."""
+    started = perf_counter()
+    rows = export_users(Database().engine, output, export_format)
+    click.echo("{0} rows exported, {1:.0f} rows/s".format(rows, rows / (perf_counter() - started)), err=True)
@@ -1,8 +1,10 @@
 from dependency_injector import containers, providers
 
+from core.config import config
 from db.cache import Caches
 from db.db import Database
 from db.rabbit import PikaClient
+from repository.access_history import AccessHistoryWriter
 from repository.repository import Repositiry
 from services.request import RequestService
 from services.roles import RoleService
@@ -28,24 +30,54 @@ class Container(containers.DeclarativeContainer):
     repository = providers.Factory(
         Repositiry, session_factory=db.provided.session_manager
     )
+    bulk_repository = providers.Factory(
+        Repositiry, session_factory=db.provided.standalone_session
+    )
+    history_writer = providers.Singleton(
+        AccessHistoryWriter,
+        session_factory=db.provided.standalone_session,
+        batch_size=config.access_history_batch_size,
+        buffer_size=config.access_history_buffer_size,
+        flush_interval=config.access_history_flush_interval,
+    )
 
     base_user_service = providers.Factory(
-        BaseUserService, repository=repository, cache=caches
+        BaseUserService,
+        repository=repository,
+        cache=caches,
+        history_writer=history_writer,
     )
     manage_user_service = providers.Factory(
-        ManageUserService, repository=repository, cache=caches, pika=rabbit_db
+        ManageUserService,
+        repository=repository,
+        cache=caches,
+        history_writer=history_writer,
+        pika=rabbit_db,
     )
     manage_social_user_service = providers.Factory(
-        ManageSocialUserService, repository=repository, cache=caches
+        ManageSocialUserService,
+        repository=repository,
+        cache=caches,
+        history_writer=history_writer,
     )
     role_user_service = providers.Factory(
-        RoleUserService, repository=repository, cache=caches
+        RoleUserService,
+        repository=repository,
+        cache=caches,
+        history_writer=history_writer,
+        bulk_repository=bulk_repository,
     )
     history_user_service = providers.Factory(
-        HistoryUserService, repository=repository, cache=caches
+        HistoryUserService,
+        repository=repository,
+        cache=caches,
+        history_writer=history_writer,
     )
 
-    role_service = providers.Factory(RoleService, repository=repository)
+    role_service = providers.Factory(RoleService, repository=repository, cache=caches)
     request_service = providers.Factory(
-        RequestService, repository=repository, cache=caches
+        RequestService,
+        repository=repository,
+        cache=caches,
+        history_writer=history_writer,
     )
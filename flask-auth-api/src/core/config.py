@@ -1,4 +1,5 @@
 import logging
+from os import cpu_count
 from typing import Optional
 
 from pydantic import BaseSettings, Field
@@ -37,11 +38,45 @@ class ConfigSettings(BaseSettings):
     access_ttl: int = Field(60 * 60, env="ACCESS_TTL")
     refresh_ttl: int = Field(60 * 60 * 24, env="REFRESH_TTL")
 
+    jwt_algorithm: str = Field("HS256", env="JWT_ALGORITHM")
+    jwt_keys_dir: str = Field("keys", env="JWT_KEYS_DIR")
+    jwt_active_kid: Optional[str] = Field(None, env="JWT_ACTIVE_KID")
+    # migration only: accept tokens signed with SECRET for REFRESH_TTL after switching to key pairs
+    jwt_accept_hs256: bool = Field(False, env="JWT_ACCEPT_HS256")
+    jwks_max_age: int = Field(60 * 10, env="JWKS_MAX_AGE")
+
     api_name: str = Field("Auth API", env="API_NAME")
     uiversion: str = Field("3", env="UIVERSION")
     openapi: str = Field("3.0.2", env="OPENAPI")
 
     request_ttl: int = Field(60, env="REQUEST_TTL")
+    request_deadline: float = Field(5.0, env="REQUEST_DEADLINE")
+    retry_max_attempts: int = Field(3, env="RETRY_MAX_ATTEMPTS")
+    circuit_failure_threshold: int = Field(5, env="CIRCUIT_FAILURE_THRESHOLD")
+    circuit_reset_timeout: float = Field(10.0, env="CIRCUIT_RESET_TIMEOUT")
+    rate_limits: dict[str, tuple[int, int]] = Field({}, env="RATE_LIMITS")
+    rate_limit_lease_ratio: float = Field(0.1, env="RATE_LIMIT_LEASE_RATIO")
+    rate_limit_sync_interval: float = Field(1.0, env="RATE_LIMIT_SYNC_INTERVAL")
+    rate_limit_local_size: int = Field(10000, env="RATE_LIMIT_LOCAL_SIZE")
+    rate_limit_fail_open: bool = Field(True, env="RATE_LIMIT_FAIL_OPEN")
+
+    revocation_cache_size: int = Field(10000, env="REVOCATION_CACHE_SIZE")
+    revocation_cache_ttl: int = Field(30, env="REVOCATION_CACHE_TTL")
+    token_check_batch_size: int = Field(100, env="TOKEN_CHECK_BATCH_SIZE")
+    roles_cache_ttl: int = Field(60 * 60, env="ROLES_CACHE_TTL")
+    role_assignment_batch_size: int = Field(1000, env="ROLE_ASSIGNMENT_BATCH_SIZE")
+    role_assignment_max_users: int = Field(100000, env="ROLE_ASSIGNMENT_MAX_USERS")
+
+    access_history_batch_size: int = Field(500, env="ACCESS_HISTORY_BATCH_SIZE")
+    access_history_buffer_size: int = Field(10000, env="ACCESS_HISTORY_BUFFER_SIZE")
+    access_history_flush_interval: float = Field(1.0, env="ACCESS_HISTORY_FLUSH_INTERVAL")
+    history_partitions_ahead: int = Field(3, env="HISTORY_PARTITIONS_AHEAD")
+    history_retention_months: int = Field(0, env="HISTORY_RETENTION_MONTHS")
+    history_maintenance_interval: int = Field(60 * 60 * 24, env="HISTORY_MAINTENANCE_INTERVAL")
+    history_export_batch_size: int = Field(1000, env="HISTORY_EXPORT_BATCH_SIZE")
+
+    grpc_port: int = Field(50051, env="GRPC_PORT")
+    grpc_workers: int = Field(10, env="GRPC_WORKERS")
 
     jager_status: bool = Field(True, env="JAGER_STATUS")
     jager_host: str = Field("127.0.0.1", env="JAGER_HOST")
@@ -59,6 +94,7 @@ class ConfigSettings(BaseSettings):
     logstash_port: int = Field(5044, env="LOGSTASH_PORT")
 
     bitly_api_access_token: str = Field("", env="BITLY_API_ACCESS_TOKEN")
+    bitly_timeout: float = Field(5.0, env="BITLY_TIMEOUT")
     email_verification_period: int = Field(1, env="EMAIL_VERIFICATION_PERIOD")
     site_domain: str = Field("example.com", env="SITE_DOMAIN")
     redirect_url: str = Field("example.com", env="REDIRECT_URL")
@@ -67,6 +103,18 @@ class ConfigSettings(BaseSettings):
     rabbit_queue: str = Field("WELCOME_QUEUE", env="RABBIT_QUEUE")
     notificaion_template: str = Field("123", env="NOTIFICATION_TEMPLATE")
 
+    hashing_workers: int = Field(cpu_count() or 1, env="HASHING_WORKERS")
+    hashing_queue_size: int = Field(64, env="HASHING_QUEUE_SIZE")
+    metrics_allowed_networks: list[str] = Field(
+        ["127.0.0.0/8", "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "::1/128"],
+        env="METRICS_ALLOWED_NETWORKS",
+    )
+    password_legacy_schemes: list[str] = Field(
+        ["pbkdf2_sha256", "pbkdf2_sha512", "sha512_crypt", "sha256_crypt", "md5_crypt"],
+        env="PASSWORD_LEGACY_SCHEMES",
+    )
+    users_import_batch_size: int = Field(10000, env="USERS_IMPORT_BATCH_SIZE")
+
 
 config = ConfigSettings()
 
@@ -10,3 +10,4 @@ class Msg(Enum):
     alredy_exists = {"msg": "Object already exists"}
     forbidden = {"msg": "Token invalid"}
     rate_limit = {"msg": "Too Many Requests"}
+    service_unavailable = {"msg": "Service Unavailable"}
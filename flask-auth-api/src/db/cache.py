@@ -1,9 +1,13 @@
+import json
 from dataclasses import dataclass
-from typing import Optional, Protocol, Type
+from threading import Thread
+from time import sleep, time
+from typing import Any, NamedTuple, Optional, Protocol, Type
 
 from redis import ConnectionError, ConnectionPool, Redis
 
 from core.config import config, logger
+from db.local_cache import LocalCache
 from utils.decorators import backoff
 from utils.exceptions import RetryExceptionError
 
@@ -18,13 +22,25 @@ class Cache(Protocol):
     def delete(self, *names: str) -> int:
         ...
 
+    def pipeline(self, transaction: bool = True) -> Any:
+        ...
+
+    def register_script(self, script: str) -> Any:
+        ...
+
+    def pubsub(self, **kwargs: Any) -> Any:
+        ...
+
+    def time(self) -> tuple[int, int]:
+        ...
+
 
 @dataclass
 class CacheManager:
     cache: Cache
     exc: Type[Exception]
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
     def get_value(self, key: str) -> Optional[str]:
         try:
             value = self.cache.get(str(key))
@@ -34,21 +50,282 @@ class CacheManager:
             return value.decode()
         return
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
     def set_value(self, name: str, value: str, ex: int) -> None:
         try:
             self.cache.set(str(name), value, ex)
         except self.exc:
             raise RetryExceptionError("Cache is not available")
 
-    backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
-
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
     def delete_value(self, name: str) -> None:
         try:
             self.cache.delete(name)
         except self.exc:
             raise RetryExceptionError("Cache is not available")
 
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def delete_values(self, names: list[str]) -> None:
+        if not names:
+            return
+        try:
+            self.cache.delete(*names)
+        except self.exc:
+            raise RetryExceptionError("Cache is not available")
+
+
+class RevocationState(NamedTuple):
+    epoch: int
+    revoked_tokens: dict
+
+
+class RevocationCache:
+    """Users' token epochs and revoked tokens stored in Redis.
+
+    The epoch is an integer embedded into every issued token, revoking all tokens of a user
+    moves it to the current Redis time in microseconds, or one past the previous epoch if that
+    is later. Tokens carrying a lower epoch are revoked. The key expires refresh_ttl after the
+    last bump, when every token it revokes has expired, and a missing key reads as epoch 0:
+    the next bump still moves past any epoch handed out before it. Single tokens are kept in a sorted set of ``jti -> revoke time``,
+    revocation is one atomic script which also drops entries older than any token they can
+    refer to. Every change is published to ``channel``, every worker keeps an in-process copy
+    of users' states which is dropped as soon as the change message arrives. Entries are only
+    served while the invalidation listener is subscribed.
+
+    Revocations written before the sorted sets, a JSON object of ``jti -> revoke time`` under
+    the bare user id with ``all`` for all tokens, are read along until refresh_ttl after the
+    first start with sorted sets, when the last token they can refer to has expired.
+
+    Args:
+        manager: CacheManager storage of revoked tokens
+        local: LocalCache in-process cache of revocation states
+    """
+
+    channel = "revocations"
+    key_prefix = "revoked"
+    epoch_key_prefix = "epoch"
+    legacy_until_key = "revocations:legacy_until"
+    bump_epoch_script = """
+        local now = redis.call("TIME")
+        local epoch = math.max(
+            tonumber(now[1]) * 1000000 + tonumber(now[2]) + 1,
+            tonumber(redis.call("GET", KEYS[1]) or 0) + 1
+        )
+        redis.call("SET", KEYS[1], string.format("%.0f", epoch), "EX", ARGV[3])
+        redis.call("PUBLISH", ARGV[1], ARGV[2])
+        return epoch
+    """
+    revoke_script = """
+        redis.call("ZADD", KEYS[1], ARGV[2], ARGV[1])
+        redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[2] - ARGV[3])
+        redis.call("EXPIRE", KEYS[1], ARGV[3])
+        redis.call("PUBLISH", ARGV[4], ARGV[5])
+    """
+
+    def __init__(self, manager: CacheManager, local: LocalCache) -> None:
+        self.manager = manager
+        self.local = local
+        self.subscribed = False
+        self._listener: Optional[Thread] = None
+        self._legacy_until: Optional[float] = None
+        self._revoke = manager.cache.register_script(self.revoke_script)
+        self._bump_epoch = manager.cache.register_script(self.bump_epoch_script)
+
+    def key(self, user_id: str) -> str:
+        return "{0}:{1}".format(self.key_prefix, user_id)
+
+    def epoch_key(self, user_id: str) -> str:
+        return "{0}:{1}".format(self.epoch_key_prefix, user_id)
+
+    def get(self, user_id: str) -> RevocationState:
+        return self.get_many([user_id])[user_id]
+
+    def get_many(self, user_ids: list[str]) -> dict[str, RevocationState]:
+        self._ensure_listener()
+        states = {}
+        if self.subscribed:
+            for user_id in user_ids:
+                state = self.local.get(user_id)
+                if state is not None:
+                    states[user_id] = state
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in states]
+        if missing:
+            version = self.local.version
+            loaded = self._load_many(missing)
+            if self.subscribed:
+                for user_id, state in loaded.items():
+                    self.local.set(user_id, state, version)
+            states.update(loaded)
+        return states
+
+    def get_epoch(self, user_id: str) -> int:
+        return self.get(user_id).epoch
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def clock(self) -> int:
+        """Return the Redis time in microseconds.
+
+        Every bump after it moves the epoch above it and every bump before it left the epoch at
+        or below it, so a token issued with it is revoked exactly by the bumps after this call.
+        It stands in for the epoch when the user is not known yet.
+        """
+        try:
+            seconds, microseconds = self.manager.cache.time()
+        except self.manager.exc:
+            raise RetryExceptionError("Cache is not available")
+        return seconds * 1000000 + microseconds
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def bump_epoch(self, user_id: str) -> int:
+        self.local.delete(user_id)
+        try:
+            return int(
+                self._bump_epoch(keys=[self.epoch_key(user_id)], args=[self.channel, user_id, config.refresh_ttl])
+            )
+        except self.manager.exc:
+            raise RetryExceptionError("Cache is not available")
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def bump_epochs(self, user_ids: list[str]) -> None:
+        """Revoke all tokens of many users with one pipeline round trip."""
+        for user_id in user_ids:
+            self.local.delete(user_id)
+        try:
+            pipe = self.manager.cache.pipeline(transaction=False)
+            for user_id in user_ids:
+                self._bump_epoch(
+                    keys=[self.epoch_key(user_id)], args=[self.channel, user_id, config.refresh_ttl], client=pipe
+                )
+            pipe.execute()
+        except self.manager.exc:
+            raise RetryExceptionError("Cache is not available")
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def revoke(self, user_id: str, jti: str) -> None:
+        self.local.delete(user_id)
+        try:
+            self._revoke(
+                keys=[self.key(user_id)],
+                args=[jti, time(), config.refresh_ttl, self.channel, user_id],
+            )
+        except self.manager.exc:
+            raise RetryExceptionError("Cache is not available")
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def _load_many(self, user_ids: list[str]) -> dict[str, RevocationState]:
+        try:
+            legacy = self._reads_legacy()
+            pipe = self.manager.cache.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.get(self.epoch_key(user_id))
+                pipe.zrange(self.key(user_id), 0, -1, withscores=True)
+                if legacy:
+                    pipe.get(user_id)
+            result = pipe.execute()
+        except self.manager.exc:
+            raise RetryExceptionError("Cache is not available")
+        step = 3 if legacy else 2
+        states = {}
+        for number, user_id in enumerate(user_ids):
+            epoch, revoked_tokens, *legacy_value = result[number * step : (number + 1) * step]
+            tokens = {jti.decode(): revoke_time for jti, revoke_time in revoked_tokens}
+            if legacy_value and legacy_value[0]:
+                for jti, revoke_time in json.loads(legacy_value[0]).items():
+                    tokens[jti] = max(float(revoke_time), tokens.get(jti, 0))
+            states[user_id] = RevocationState(epoch=int(epoch or 0), revoked_tokens=tokens)
+        return states
+
+    def _reads_legacy(self) -> bool:
+        if self._legacy_until is None:
+            pipe = self.manager.cache.pipeline(transaction=False)
+            pipe.set(self.legacy_until_key, time() + config.refresh_ttl, nx=True)
+            pipe.get(self.legacy_until_key)
+            self._legacy_until = float(pipe.execute()[1])
+        return time() < self._legacy_until
+
+    def _ensure_listener(self) -> None:
+        if self._listener is None or not self._listener.is_alive():
+            self.subscribed = False
+            self._listener = Thread(target=self._listen, daemon=True)
+            self._listener.start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self.manager.cache.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.local.clear()
+                self.subscribed = True
+                for message in pubsub.listen():
+                    self.local.delete(message["data"].decode())
+            except self.manager.exc:
+                logger.exception("revocation listener disconnected")
+            self.subscribed = False
+            self.local.clear()
+            sleep(1)
+
+
+class RolesCache:
+    """Names of users' roles cached for issuing tokens.
+
+    Every invalidation deletes the user's entry and increments the user's version. A reader
+    takes the version together with the entry and, on a miss, stores the roles it read from the
+    database only if the version is still the same. Roles read before a concurrent change are
+    never cached after it.
+
+    Args:
+        manager: CacheManager storage of cached roles
+        ttl: int seconds roles and versions are kept
+    """
+
+    version_key_prefix = "version"
+    set_script = """
+        if (redis.call("GET", KEYS[2]) or "") == ARGV[3] then
+            redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+        end
+    """
+
+    def __init__(self, manager: CacheManager, ttl: int) -> None:
+        self.manager = manager
+        self.ttl = ttl
+        self._set = manager.cache.register_script(self.set_script)
+
+    def version_key(self, user_id: str) -> str:
+        return "{0}:{1}".format(self.version_key_prefix, user_id)
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def get(self, user_id: str) -> tuple[Optional[list], str]:
+        """Return cached roles or None and the version to store roles read now with."""
+        try:
+            pipe = self.manager.cache.pipeline(transaction=False)
+            pipe.get(user_id)
+            pipe.get(self.version_key(user_id))
+            roles, version = pipe.execute()
+        except self.manager.exc:
+            raise RetryExceptionError("Cache is not available")
+        return json.loads(roles) if roles else None, version.decode() if version else ""
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def set(self, user_id: str, roles: list, version: str) -> None:
+        try:
+            self._set(keys=[user_id, self.version_key(user_id)], args=[json.dumps(roles), self.ttl, version])
+        except self.manager.exc:
+            raise RetryExceptionError("Cache is not available")
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="redis")
+    def invalidate(self, user_ids: list[str]) -> None:
+        if not user_ids:
+            return
+        try:
+            pipe = self.manager.cache.pipeline(transaction=False)
+            pipe.delete(*user_ids)
+            for user_id in user_ids:
+                pipe.incr(self.version_key(user_id))
+                pipe.expire(self.version_key(user_id), self.ttl)
+            pipe.execute()
+        except self.manager.exc:
+            raise RetryExceptionError("Cache is not available")
+
 
 @dataclass
 class Caches:
@@ -64,3 +341,14 @@ class Caches:
         Redis(connection_pool=ConnectionPool(host=config.redis_host, port=config.redis_port, db=5)),
         ConnectionError,
     )
+    roles_cache: RolesCache = RolesCache(
+        CacheManager(
+            Redis(connection_pool=ConnectionPool(host=config.redis_host, port=config.redis_port, db=6)),
+            ConnectionError,
+        ),
+        config.roles_cache_ttl,
+    )
+    revocations: RevocationCache = RevocationCache(
+        access_cache,
+        LocalCache(maxsize=config.revocation_cache_size, ttl=config.revocation_cache_ttl),
+    )
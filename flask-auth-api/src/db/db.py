@@ -1,14 +1,98 @@
 from contextlib import contextmanager
+from typing import Callable
 
+from flask import Flask, g, has_request_context
+from flask.wrappers import Response
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
 from sqlalchemy import create_engine
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, scoped_session, sessionmaker
 
-from core.config import config
+from core.config import config, logger
+from utils.exceptions import DependencyUnavailableError, RetryExceptionError
+from utils.metrics import AFTER_COMMIT_FAILURES
 
 Base = declarative_base()
 
 
+class RequestSession(Session):
+    """Session shared by all repository calls made while handling one request.
+
+    Repository commits only flush, the request's transaction is committed once when the
+    response is ready, or rolled back if the request failed. Once writes of the request are
+    flushed every further write runs in a savepoint, so a failed statement rolls back only
+    that write, reads take no savepoint. If the whole transaction is lost anyway, e.g. the
+    connection was lost, a retry of the request's writes is refused. Callbacks added with
+    after_commit run after the transaction is committed, they are kept as long as the writes
+    of the request are and dropped with them.
+    """
+
+    def begin_call(self, write: bool) -> None:
+        if write and self.info.get("flushed"):
+            self.info["savepoint"] = self.begin_nested()
+
+    def end_call(self) -> None:
+        savepoint = self.info.pop("savepoint", None)
+        if savepoint is None:
+            return
+        if savepoint.is_active:
+            savepoint.commit()
+        else:
+            savepoint.rollback()
+
+    def commit(self) -> None:
+        savepoint = self.info.get("savepoint")
+        if savepoint is not None:
+            savepoint.commit()
+            del self.info["savepoint"]
+        else:
+            self.flush()
+        self.info["flushed"] = True
+
+    def rollback(self) -> None:
+        savepoint = self.info.pop("savepoint", None)
+        if savepoint is not None:
+            try:
+                savepoint.rollback()
+                return
+            except DBAPIError:
+                pass
+        super().rollback()
+        if self.info.pop("flushed", False):
+            self.info["lost_writes"] = True
+
+    def recover(self) -> None:
+        """Prepare the session for a retry of the call which failed.
+
+        A failed write is rolled back to its savepoint. A failed read leaves the flushed writes
+        alone while the transaction can still run statements, otherwise it is rolled back.
+        """
+        if "savepoint" not in self.info and self.info.get("flushed") and self._transaction_usable():
+            return
+        self.rollback()
+
+    def commit_request(self) -> None:
+        super().commit()
+        for callback in self.info.pop("after_commit", []):
+            try:
+                callback()
+            except Exception:
+                AFTER_COMMIT_FAILURES.inc()
+                logger.exception("after commit callback failed, the transaction is kept")
+
+    def discard(self) -> None:
+        super().rollback()
+        self.info.clear()
+
+    def _transaction_usable(self) -> bool:
+        try:
+            connection = self.connection().connection
+            return not connection.closed and connection.get_transaction_status() != TRANSACTION_STATUS_INERROR
+        except (AttributeError, SQLAlchemyError):
+            return False
+
+
 class Database:
     def __init__(self) -> None:
         self.engine = create_engine(
@@ -22,12 +106,75 @@ class Database:
             pool_size=10,
             max_overflow=20,
         )
-        self.db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=self.engine))
+        self.db_session = scoped_session(
+            sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=self.engine)
+        )
+        self.request_session = sessionmaker(class_=RequestSession, autocommit=False, autoflush=False, bind=self.engine)
 
     @contextmanager
-    def session_manager(self):
+    def session_manager(self, write: bool = False):
+        """Yield the session of the current request, or a new session outside of requests.
+
+        Calls which change data pass write, see RequestSession.
+        """
+        if not has_request_context():
+            with self.standalone_session() as session:
+                yield session
+            return
+
+        if "db_session" not in g:
+            g.db_session = self.request_session()
+        session: RequestSession = g.db_session
+        session.begin_call(write)
+        try:
+            yield session
+        except RetryExceptionError:
+            session.recover()
+            if session.info.get("lost_writes"):
+                raise DependencyUnavailableError("postgres")
+            raise
+        finally:
+            session.end_call()
+
+    @contextmanager
+    def standalone_session(self, write: bool = False):
+        """Yield a new session which is closed on exit, independent of the current request.
+
+        The session commits on its own, write is accepted for the repository's sake.
+        """
         session: Session = self.db_session()
         try:
             yield session
         finally:
             session.close()
+
+    def commit_request(self, response: Response) -> Response:
+        session = g.get("db_session")
+        if session is not None:
+            if response.status_code >= 500:
+                session.discard()
+                return response
+            session.commit_request()
+        return response
+
+    def close_request(self, exc) -> None:
+        session = g.pop("db_session", None)
+        if session is not None:
+            session.close()
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    """Run callback once the current request's transaction is committed, or right away if no
+    transaction of a request is open. Cache invalidation and published events go through it,
+    so they never describe writes which are rolled back later."""
+    session = g.get("db_session") if has_request_context() else None
+    if session is None:
+        callback()
+        return
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+def configure_request_session(app: Flask, database: Database) -> None:
+    """Share one session and one transaction between all repository calls of a request."""
+    app.after_request(database.commit_request)
+    app.teardown_request(database.close_request)
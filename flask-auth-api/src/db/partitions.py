@@ -0,0 +1,141 @@
+import re
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from core.config import config, logger
+
+
+def add_months(day: date, months: int) -> date:
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+class PartitionManager:
+    """Monthly range partitions of a table partitioned by a date column.
+
+    Partitions are named ``<table>_y<year>m<month>`` and cover one calendar month. Rows which
+    landed in the default partition are moved to the monthly partition created for them,
+    partitions older than the retention window are detached and dropped. Every step runs in
+    its own transaction under an advisory lock, so concurrent runs skip instead of blocking.
+
+    Args:
+        table: str partitioned table name
+        column: str partition key column
+        months_ahead: int months after the current one to create partitions for
+        retention_months: int months to keep before the current one, 0 keeps everything
+    """
+
+    def __init__(self, table: str, column: str, months_ahead: int, retention_months: int) -> None:
+        self.table = table
+        self.column = column
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.name_pattern = re.compile(r"^{0}_y(\d{{4}})m(\d{{1,2}})$".format(re.escape(table)))
+
+    @property
+    def default_partition(self) -> str:
+        return "{0}_default".format(self.table)
+
+    def partition_name(self, month: date) -> str:
+        return "{0}_y{1}m{2}".format(self.table, month.year, month.month)
+
+    def run(self, engine: Engine, detach_only: bool = False, today: Optional[date] = None) -> None:
+        today = today or date.today()
+        with engine.begin() as connection:
+            if self._lock(connection):
+                self.create_partitions(connection, today)
+        with engine.begin() as connection:
+            if self._lock(connection):
+                self.move_default_rows(connection)
+        with engine.begin() as connection:
+            if self._lock(connection):
+                self.drop_expired(connection, detach_only, today)
+
+    def create_partitions(self, connection: Connection, today: date) -> list[str]:
+        connection.execute(
+            text(
+                'CREATE TABLE IF NOT EXISTS "{0}" PARTITION OF "{1}" DEFAULT'.format(
+                    self.default_partition, self.table
+                )
+            )
+        )
+        current = today.replace(day=1)
+        return [self._create_partition(connection, add_months(current, n)) for n in range(self.months_ahead + 1)]
+
+    def move_default_rows(self, connection: Connection) -> list[str]:
+        months = connection.execute(
+            text(
+                'SELECT DISTINCT date_trunc(\'month\', "{0}")::date FROM "{1}"'.format(
+                    self.column, self.default_partition
+                )
+            )
+        ).scalars()
+        return [self._create_partition(connection, month) for month in sorted(months)]
+
+    def drop_expired(self, connection: Connection, detach_only: bool, today: date) -> list[str]:
+        if not self.retention_months:
+            return []
+        cutoff = add_months(today.replace(day=1), -self.retention_months)
+        expired = []
+        for name in self.partitions(connection):
+            match = self.name_pattern.match(name)
+            if match and date(int(match.group(1)), int(match.group(2)), 1) < cutoff:
+                connection.execute(text('ALTER TABLE "{0}" DETACH PARTITION "{1}"'.format(self.table, name)))
+                if not detach_only:
+                    connection.execute(text('DROP TABLE "{0}"'.format(name)))
+                logger.info("partition %s expired", name)
+                expired.append(name)
+        return expired
+
+    def partitions(self, connection: Connection) -> list[str]:
+        return list(
+            connection.execute(
+                text(
+                    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                    "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"
+                ),
+                {"table": self.table},
+            ).scalars()
+        )
+
+    def _create_partition(self, connection: Connection, month: date) -> str:
+        """Create a monthly partition, rows of that month are moved out of the default one first."""
+        name = self.partition_name(month)
+        bounds = {"start": month, "end": add_months(month, 1)}
+        if name in self.partitions(connection):
+            return name
+        connection.execute(
+            text(
+                'CREATE TEMPORARY TABLE moved_rows ON COMMIT DROP AS WITH moved AS (DELETE FROM "{0}" '
+                'WHERE "{1}" >= :start AND "{1}" < :end RETURNING *) SELECT * FROM moved'.format(
+                    self.default_partition, self.column
+                )
+            ),
+            bounds,
+        )
+        connection.execute(
+            text(
+                'CREATE TABLE "{0}" PARTITION OF "{1}" FOR VALUES FROM (:start) TO (:end)'.format(name, self.table)
+            ),
+            bounds,
+        )
+        connection.execute(text('INSERT INTO "{0}" SELECT * FROM moved_rows'.format(self.table)))
+        connection.execute(text("DROP TABLE moved_rows"))
+        logger.info("partition %s created", name)
+        return name
+
+    def _lock(self, connection: Connection) -> bool:
+        return connection.execute(
+            text("SELECT pg_try_advisory_xact_lock(hashtext(:table))"), {"table": self.table}
+        ).scalar()
+
+
+history_partitions = PartitionManager(
+    table="users_access_history",
+    column="login_date",
+    months_ahead=config.history_partitions_ahead,
+    retention_months=config.history_retention_months,
+)
@@ -0,0 +1,81 @@
+import csv
+import io
+from typing import TextIO
+
+from sqlalchemy import Boolean, Column, MetaData, String, Table, cast, literal, select
+from sqlalchemy.dialects.postgresql import UUID, insert
+from sqlalchemy.engine import Engine
+
+from models.db_models import User
+
+IMPORT_COLUMNS = ("id", "login", "password", "email", "is_superuser")
+
+users = User.__table__
+
+staging = Table(
+    "users_import",
+    MetaData(),
+    Column("id", UUID(as_uuid=True)),
+    Column("login", String),
+    Column("password", String),
+    Column("email", String),
+    Column("is_superuser", Boolean),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def _insert_from_staging():
+    # COPY does not run the model's Python side defaults, the other columns get them as literals
+    defaults = {
+        column.name: column.default.arg
+        for column in users.columns
+        if column.name not in IMPORT_COLUMNS and column.default is not None and column.default.is_scalar
+    }
+    rows = select(
+        *(staging.c[name] for name in IMPORT_COLUMNS),
+        *(
+            cast(literal(value, users.c[name].type), users.c[name].type).label(name)
+            for name, value in defaults.items()
+        ),
+    )
+    return insert(users).from_select([*IMPORT_COLUMNS, *defaults], rows).on_conflict_do_nothing()
+
+
+def copy_users(engine: Engine, records: list[tuple]) -> int:
+    """Load users with COPY into a temporary table and move them to users in one transaction.
+
+    Records are tuples of IMPORT_COLUMNS values. Users whose id or login already exist are
+    skipped, so a batch can be loaded again. Returns the number of inserted users.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(records)
+    buffer.seek(0)
+    with engine.begin() as connection:
+        staging.create(connection)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            "COPY {0} ({1}) FROM STDIN WITH (FORMAT csv)".format(staging.name, ", ".join(IMPORT_COLUMNS)), buffer
+        )
+        return connection.execute(_insert_from_staging()).rowcount
+
+
+def export_users(engine: Engine, output: TextIO, export_format: str) -> int:
+    """Stream users to output with COPY as CSV with a header or as NDJSON, return the number of rows.
+
+    Password hashes are exported as they are, the output can be loaded back with copy_users.
+    """
+    query = select(*(users.c[name] for name in IMPORT_COLUMNS)).order_by(users.c.id)
+    query = str(query.compile(dialect=engine.dialect))
+    if export_format == "csv":
+        statement = "COPY ({0}) TO STDOUT WITH (FORMAT csv, HEADER)".format(query)
+    else:
+        # CSV with quote and delimiter which JSON never contains writes every document as is
+        statement = (
+            "COPY (SELECT row_to_json(u) FROM ({0}) AS u) TO STDOUT "
+            "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')".format(query)
+        )
+    with engine.connect() as connection:
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(statement, output)
+        return cursor.rowcount
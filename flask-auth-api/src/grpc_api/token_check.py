@@ -0,0 +1,35 @@
+from typing import Iterator
+
+import grpc
+from flask import Flask
+
+from grpc_api import token_check_pb2, token_check_pb2_grpc
+from services.users import RoleUserService, TokenCheck
+from utils.exceptions import DependencyUnavailableError
+
+
+class TokenCheckServicer(token_check_pb2_grpc.TokenCheckServicer):
+    def __init__(self, app: Flask) -> None:
+        self.app = app
+
+    def CheckToken(self, request, context) -> token_check_pb2.CheckTokenResponse:
+        with self.app.app_context():
+            try:
+                check = self._service().check_many_user_roles([request.access_token])[0]
+            except DependencyUnavailableError as error:
+                context.abort(grpc.StatusCode.UNAVAILABLE, str(error))
+        return self._to_response(check)
+
+    def CheckTokenStream(self, request_iterator, context) -> Iterator[token_check_pb2.CheckTokenResponse]:
+        for request in request_iterator:
+            yield self.CheckToken(request, context)
+
+    def _service(self) -> RoleUserService:
+        return self.app.container.role_user_service()  # type: ignore
+
+    @staticmethod
+    def _to_response(check: TokenCheck) -> token_check_pb2.CheckTokenResponse:
+        return token_check_pb2.CheckTokenResponse(
+            status=token_check_pb2.TokenStatus.Value(check.status.upper()),
+            roles=check.roles,
+        )
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: grpc_api/token_check.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x1agrpc_api/token_check.proto\x12\x07\x61uth.v1\")\n\x11\x43heckTokenRequest\x12\x14\n\x0c\x61\x63\x63\x65ss_token\x18\x01 \x01(\t\"I\n\x12\x43heckTokenResponse\x12$\n\x06status\x18\x01 \x01(\x0e\x32\x14.auth.v1.TokenStatus\x12\r\n\x05roles\x18\x02 \x03(\t*P\n\x0bTokenStatus\x12\x1c\n\x18TOKEN_STATUS_UNSPECIFIED\x10\x00\x12\t\n\x05VALID\x10\x01\x12\x0b\n\x07REVOKED\x10\x02\x12\x0b\n\x07INVALID\x10\x03\x32\xa4\x01\n\nTokenCheck\x12\x45\n\nCheckToken\x12\x1a.auth.v1.CheckTokenRequest\x1a\x1b.auth.v1.CheckTokenResponse\x12O\n\x10\x43heckTokenStream\x12\x1a.auth.v1.CheckTokenRequest\x1a\x1b.auth.v1.CheckTokenResponse(\x01\x30\x01\x62\x06proto3')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'grpc_api.token_check_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _TOKENSTATUS._serialized_start=157
+  _TOKENSTATUS._serialized_end=237
+  _CHECKTOKENREQUEST._serialized_start=39
+  _CHECKTOKENREQUEST._serialized_end=80
+  _CHECKTOKENRESPONSE._serialized_start=82
+  _CHECKTOKENRESPONSE._serialized_end=155
+  _TOKENCHECK._serialized_start=240
+  _TOKENCHECK._serialized_end=404
+# @@protoc_insertion_point(module_scope)
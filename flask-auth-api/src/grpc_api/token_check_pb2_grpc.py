@@ -0,0 +1,102 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+
+from grpc_api import token_check_pb2 as grpc__api_dot_token__check__pb2
+
+
+class TokenCheckStub(object):
+    """Same checks as POST /api/v1/roles/user/check for internal services.
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.CheckToken = channel.unary_unary(
+                '/auth.v1.TokenCheck/CheckToken',
+                request_serializer=grpc__api_dot_token__check__pb2.CheckTokenRequest.SerializeToString,
+                response_deserializer=grpc__api_dot_token__check__pb2.CheckTokenResponse.FromString,
+                )
+        self.CheckTokenStream = channel.stream_stream(
+                '/auth.v1.TokenCheck/CheckTokenStream',
+                request_serializer=grpc__api_dot_token__check__pb2.CheckTokenRequest.SerializeToString,
+                response_deserializer=grpc__api_dot_token__check__pb2.CheckTokenResponse.FromString,
+                )
+
+
+class TokenCheckServicer(object):
+    """Same checks as POST /api/v1/roles/user/check for internal services.
+    """
+
+    def CheckToken(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def CheckTokenStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_TokenCheckServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'CheckToken': grpc.unary_unary_rpc_method_handler(
+                    servicer.CheckToken,
+                    request_deserializer=grpc__api_dot_token__check__pb2.CheckTokenRequest.FromString,
+                    response_serializer=grpc__api_dot_token__check__pb2.CheckTokenResponse.SerializeToString,
+            ),
+            'CheckTokenStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.CheckTokenStream,
+                    request_deserializer=grpc__api_dot_token__check__pb2.CheckTokenRequest.FromString,
+                    response_serializer=grpc__api_dot_token__check__pb2.CheckTokenResponse.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'auth.v1.TokenCheck', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+
+
+ # This class is part of an EXPERIMENTAL API.
+class TokenCheck(object):
+    """Same checks as POST /api/v1/roles/user/check for internal services.
+    """
+
+    @staticmethod
+    def CheckToken(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/auth.v1.TokenCheck/CheckToken',
+            grpc__api_dot_token__check__pb2.CheckTokenRequest.SerializeToString,
+            grpc__api_dot_token__check__pb2.CheckTokenResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def CheckTokenStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/auth.v1.TokenCheck/CheckTokenStream',
+            grpc__api_dot_token__check__pb2.CheckTokenRequest.SerializeToString,
+            grpc__api_dot_token__check__pb2.CheckTokenResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -0,0 +1,22 @@
+from concurrent import futures
+
+import grpc
+
+from core.config import config, logger
+from grpc_api import token_check_pb2_grpc
+from grpc_api.token_check import TokenCheckServicer
+from main import create_app
+
+
+def serve() -> None:
+    app = create_app()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=config.grpc_workers))
+    token_check_pb2_grpc.add_TokenCheckServicer_to_server(TokenCheckServicer(app), server)
+    server.add_insecure_port("[::]:{0}".format(config.grpc_port))
+    server.start()
+    logger.info("grpc server started on port {0}".format(config.grpc_port))
+    server.wait_for_termination()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,3 @@
+def worker_exit(server, worker):
+    """Insert the login records the worker still buffers before it exits, see AccessHistoryWriter."""
+    worker.wsgi.container.history_writer().flush()
@@ -1,20 +1,40 @@
 import logging
 from datetime import timedelta
+from http import HTTPStatus
 
 from flasgger import Swagger
-from flask import Flask
+from flask import Flask, Response, jsonify, make_response
 from flask_jwt_extended import JWTManager
 
 import api.v1.request as request_api
 import api.v1.roles as roles_api
 import api.v1.users as users_api
+import api.well_known as well_known_api
+from commands.history import history_cli
+from commands.keys import keys_cli
+from commands.partitions import partitions_cli
+from commands.roles import roles_cli
 from commands.superuser import superuser_cli
+from commands.users import users_cli
 from containers.container import Container
 from core.config import SWAGGER_TEMPLATE, config
+from core.msg import Msg
+from db.db import configure_request_session
+from models.users_response_schemas import MsgSchema
 from social.oauth import oauth
+from utils.exceptions import DependencyUnavailableError
+from utils.keys import configure_signing_keys
+from utils.metrics import configure_metrics
 from utils.tracing import configure_tracing
 
 
+def dependency_unavailable(error: DependencyUnavailableError) -> Response:
+    return make_response(
+        jsonify(MsgSchema().load(Msg.service_unavailable.value)),
+        HTTPStatus.SERVICE_UNAVAILABLE.value,
+    )
+
+
 def create_app() -> Flask:
     container = Container()
     app = Flask(__name__)
@@ -25,12 +45,21 @@ def create_app() -> Flask:
     app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(seconds=config.access_ttl)
     app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(seconds=config.refresh_ttl)
     jwt = JWTManager(app)
+    configure_signing_keys(app, jwt)
 
     app.cli.add_command(superuser_cli)
+    app.cli.add_command(history_cli)
+    app.cli.add_command(keys_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(roles_cli)
+    app.cli.add_command(users_cli)
 
     app.register_blueprint(users_api.bp)
     app.register_blueprint(roles_api.bp)
     app.register_blueprint(request_api.bp)
+    app.register_blueprint(well_known_api.bp)
+    app.register_error_handler(DependencyUnavailableError, dependency_unavailable)
+    configure_request_session(app, container.db())
 
     app.config["SWAGGER"] = {
         "title": config.api_name,
@@ -38,6 +67,7 @@ def create_app() -> Flask:
         "openapi": config.openapi,
     }
     swag = Swagger(app, template=SWAGGER_TEMPLATE)
+    configure_metrics(app)
     if config.jager_status:
         configure_tracing(app)
 
@@ -1,10 +1,10 @@
 import enum
 import uuid
-from datetime import datetime
+from datetime import date
 from functools import partial
 from typing import Optional
 
-from sqlalchemy import Boolean, Column, DateTime, Enum, Float, ForeignKey, String, Table
+from sqlalchemy import Boolean, Column, DateTime, Enum, Float, ForeignKey, Index, Integer, String, Table
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.event import listen
 from sqlalchemy.orm import backref, relationship
@@ -12,6 +12,7 @@ from sqlalchemy.sql import func
 from sqlalchemy.sql.schema import UniqueConstraint
 
 from db.db import Base
+from db.partitions import history_partitions
 from utils.password_hashing import verify_password
 
 user_role_association_table = Table(
@@ -83,16 +84,7 @@ class Role(Base):
 
 
 def create_user_history_partitions(target, connection, **kw) -> None:
-    current_date = datetime.now()
-    year = current_date.year
-    month = current_date.month
-    connection.execute(
-        """CREATE TABLE IF NOT EXISTS "users_access_history_default" PARTITION OF "users_access_history" DEFAULT;"""
-    )
-    for m in range(month, 12):
-        connection.execute(
-            f"""CREATE TABLE IF NOT EXISTS "users_access_history_y{year}m{m}" PARTITION OF "users_access_history" FOR VALUES FROM ('{year}-{m}-01') TO ('{year}-{m + 1}-01')"""
-        )
+    history_partitions.create_partitions(connection, date.today())
 
 
 def on_table_create(class_, ddl):
@@ -107,6 +99,8 @@ class UserAccessHistory(Base):
     __tablename__ = "users_access_history"
     __table_args__ = (
         UniqueConstraint("id", "login_date", name="user_acc_hist_id_login_date"),
+        Index("ix_users_access_history_user_id_login_date_id", "user_id", "login_date", "id"),
+        Index("ix_users_access_history_request_id_login_date", "request_id", "login_date"),
         {
             "postgresql_partition_by": "RANGE (login_date)",
         },
@@ -134,6 +128,25 @@ class UserAccessHistory(Base):
         return "User {0} access {1} with status {2}".format(self.user_id, self.login_date, self.login_status)
 
 
+PASSWORD_LOGIN = "password"
+
+
+class LoginStat(Base):
+    """Hourly login counts per user, login service and status rolled up from users_access_history."""
+
+    __tablename__ = "login_stats"
+    __table_args__ = (Index("ix_login_stats_user_id_bucket", "user_id", "bucket"),)
+
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    service_name = Column(String, primary_key=True)
+    login_status = Column(Boolean, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return "Login stat {0} {1} {2}: {3}".format(self.bucket, self.user_id, self.service_name, self.count)
+
+
 class SocialAccount(Base):
     __tablename__ = "social_account"
 
@@ -146,7 +159,7 @@ class SocialAccount(Base):
 
     __table_args__ = (UniqueConstraint("social_id", "social_name", name="social_pk"),)
 
-    def __init__(self, user_id: UUID, social_id: str, social_name: str) -> None:
+    def __init__(self, social_id: str, social_name: str, user_id: Optional[UUID] = None) -> None:
         self.user_id = user_id
         self.social_id = social_id
         self.social_name = social_name
@@ -1,9 +1,14 @@
+from datetime import datetime, timezone
 from enum import Enum
 
 from flasgger import Schema, fields
-from marshmallow.validate import OneOf, Range
+from marshmallow import ValidationError, post_load, validates_schema
+from marshmallow.validate import Length, OneOf, Range
 
+from core.config import config
 from social.providers import Providers
+from utils.export import EXPORT_FORMATS
+from utils.pagination import decode_cursor
 
 
 class DefaultPaginator(Enum):
@@ -60,10 +65,60 @@ class PaginationSchema(Schema):
     )
 
 
-class UserHistoryQuerySchema(PaginationSchema):
-    year = fields.Int()
+class CursorField(fields.Str):
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            return decode_cursor(super()._deserialize(value, attr, data, **kwargs))
+        except ValueError as error:
+            raise ValidationError(str(error)) from error
+
+
+class DateRangeSchema(Schema):
+    date_from = fields.AwareDateTime(data_key="from", default_timezone=timezone.utc)
+    date_to = fields.AwareDateTime(data_key="to", default_timezone=timezone.utc)
+
+    @validates_schema
+    def validate_range(self, data, **kwargs):
+        if data.get("date_from") and data.get("date_to") and data["date_from"] >= data["date_to"]:
+            raise ValidationError("from must be earlier than to", "from")
+
+
+class HistoryExportQuerySchema(DateRangeSchema):
+    format = fields.Str(validate=OneOf(list(EXPORT_FORMATS)), load_default="ndjson")
+
+
+class LoginStatsQuerySchema(DateRangeSchema):
+    granularity = fields.Str(validate=OneOf(["hour", "day", "provider"]), load_default="day")
+    group_by = fields.Str(validate=OneOf(["user_id"]))
+    user_id = fields.UUID()
+    login_status = fields.Bool()
+
+
+class LoginStatSchema(Schema):
+    bucket = fields.DateTime()
+    user_id = fields.UUID()
+    service_name = fields.Str()
+    login_status = fields.Bool()
+    count = fields.Int()
+
+
+class UserHistoryQuerySchema(PaginationSchema, DateRangeSchema):
+    cursor = CursorField()
+    # the range of the last month ends in the next year, which datetime still supports
+    year = fields.Int(validate=Range(1, 9998))
     month = fields.Int(validate=Range(1, 12))
 
+    @post_load
+    def month_range(self, data, **kwargs):
+        """Translate year and month, the current month by default, into a from/to range."""
+        if "date_from" in data or "date_to" in data:
+            return data
+        now = datetime.now(timezone.utc)
+        year, month = data.pop("year", now.year), data.pop("month", now.month)
+        data["date_from"] = datetime(year, month, 1, tzinfo=timezone.utc)
+        data["date_to"] = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        return data
+
 
 class UserVerificationQuerySchema(Schema):
     expired = fields.Str(required=True)
@@ -76,14 +131,41 @@ class RoleSchema(Schema):
     description = fields.Str(required=True)
 
 
+class RoleConflictSchema(MsgSchema):
+    conflicts = fields.List(fields.Str(), required=True)
+
+
 class UserRoleSchema(Schema):
     role_id = fields.List(fields.Str(), required=True)
 
 
+class BulkUserRoleSchema(Schema):
+    user_id = fields.List(
+        fields.UUID(), required=True, validate=Length(min=1, max=config.role_assignment_max_users),
+    )
+    role_id = fields.List(fields.UUID(), required=True, validate=Length(min=1))
+
+
+class RoleAssignmentSchema(Schema):
+    users = fields.Int(required=True)
+    updated = fields.Int(required=True)
+
+
 class CheckAccessTokenSchema(Schema):
     access_token = fields.Str(required=True)
 
 
+class CheckAccessTokensSchema(Schema):
+    access_tokens = fields.List(
+        fields.Str(), required=True, validate=Length(min=1, max=config.token_check_batch_size),
+    )
+
+
+class TokenCheckSchema(Schema):
+    status = fields.Str(required=True)
+    roles = fields.List(fields.Str(), required=True)
+
+
 class ProvidersSchema(Schema):
     provider = fields.Str(required=True, validate=OneOf([field.name for field in Providers]))
 
@@ -0,0 +1,186 @@
+import uuid
+from collections import deque
+from contextlib import AbstractContextManager
+from datetime import datetime, timezone
+from threading import Event, Lock, Thread
+from typing import Callable, Optional
+from uuid import UUID
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import Insert, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from core.config import logger
+from models.db_models import PASSWORD_LOGIN, LoginStat, UserAccessHistory
+from utils.decorators import backoff
+from utils.exceptions import DependencyUnavailableError, RetryExceptionError
+from utils.metrics import ACCESS_HISTORY_BUFFER_DEPTH
+
+
+class AccessHistoryWriter:
+    """Buffer users' login records and insert them in batches.
+
+    Records wait in a bounded in-process buffer and a background thread inserts them every
+    ``flush_interval`` seconds, or as soon as ``batch_size`` records are waiting, with one
+    multi-row INSERT per batch which also adds the inserted records to the hourly login_stats
+    rollup. A batch failed because the database is not available goes back to the buffer and
+    is retried, records get their id and login date when they are added so a repeated insert
+    is neither stored nor counted twice. Any other failure is retried record by record and the
+    records which still fail are logged and dropped, so they never block the buffer. When the
+    buffer is full the record is inserted right away. Readers of the history see records once
+    they are flushed. The gunicorn worker flushes the buffer when it exits, see gunicorn.conf.py.
+
+    Args:
+        session_factory: Callable database session context manager
+        batch_size: int maximum records in one INSERT
+        buffer_size: int maximum records waiting in the buffer
+        flush_interval: float seconds between flushes
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[..., AbstractContextManager[Session]],
+        batch_size: int,
+        buffer_size: int,
+        flush_interval: float,
+    ) -> None:
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque()
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._thread: Optional[Thread] = None
+
+    def add(
+        self,
+        user_id: UUID,
+        user_agent: Optional[str],
+        login_status: bool,
+        request_id: str,
+        service_name: Optional[str] = None,
+    ) -> datetime:
+        """Buffer a login record and return its login date, the partition key of the row."""
+        record = {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "user_agent": user_agent,
+            "login_date": datetime.now(timezone.utc),
+            "login_status": login_status,
+            "service_name": service_name,
+            "request_id": request_id,
+            "totp_status": True,
+        }
+        with self._lock:
+            buffered = len(self._buffer) < self.buffer_size
+            if buffered:
+                self._buffer.append(record)
+            depth = len(self._buffer)
+        if not buffered:
+            self._insert([record])
+            return record["login_date"]
+        ACCESS_HISTORY_BUFFER_DEPTH.set(depth)
+        self._ensure_thread()
+        if depth >= self.batch_size:
+            self._wakeup.set()
+        return record["login_date"]
+
+    def flush(self) -> None:
+        """Insert the buffered records."""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    return
+                try:
+                    self._insert_batch(batch)
+                finally:
+                    ACCESS_HISTORY_BUFFER_DEPTH.set(len(self._buffer))
+
+    def update_record(self, request_id: str, values: dict) -> bool:
+        """Update the buffered record of request_id, return False if it is already inserted.
+
+        A record which is being inserted is waited for, so the caller can update the row then.
+        """
+        with self._lock:
+            for record in self._buffer:
+                if record["request_id"] == request_id:
+                    record.update(values)
+                    return True
+        with self._flush_lock:
+            return False
+
+    def _insert_batch(self, batch: list[dict]) -> None:
+        try:
+            self._insert(batch)
+            return
+        except (DependencyUnavailableError, OperationalError, RetryExceptionError):
+            self._requeue(batch)
+            raise
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("access history record {0} dropped".format(batch[0]["id"]))
+                return
+        for number, record in enumerate(batch):
+            try:
+                self._insert([record])
+            except (DependencyUnavailableError, OperationalError, RetryExceptionError):
+                self._requeue(batch[number:])
+                raise
+            except Exception:
+                logger.exception("access history record {0} dropped".format(record["id"]))
+
+    def _requeue(self, records: list[dict]) -> None:
+        """Put records back in front of the buffer in their original order."""
+        with self._lock:
+            self._buffer.extendleft(reversed(records))
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("failed to flush access history")
+
+    @staticmethod
+    def _insert_statement(records: list[dict]) -> Insert:
+        """Insert records and add the ones actually inserted to hourly login_stats in one statement."""
+        history = UserAccessHistory.__table__
+        stats = LoginStat.__table__
+        inserted = (
+            insert(history)
+            .values(records)
+            .on_conflict_do_nothing()
+            .returning(history.c.login_date, history.c.user_id, history.c.service_name, history.c.login_status)
+            .cte("inserted")
+        )
+        bucket = func.date_trunc("hour", inserted.c.login_date)
+        service_name = func.coalesce(inserted.c.service_name, PASSWORD_LOGIN)
+        group_by = (bucket, inserted.c.user_id, service_name, inserted.c.login_status)
+        rollup = select(*group_by, func.count()).where(inserted.c.user_id.isnot(None)).group_by(*group_by)
+        statement = insert(stats).from_select(["bucket", "user_id", "service_name", "login_status", "count"], rollup)
+        return statement.on_conflict_do_update(
+            index_elements=["bucket", "user_id", "service_name", "login_status"],
+            set_={"count": stats.c.count + statement.excluded.count},
+        )
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def _insert(self, records: list[dict]) -> None:
+        with self.session_factory() as session:
+            try:
+                session.execute(self._insert_statement(records))
+                session.commit()
+            except OperationalError:
+                session.rollback()
+                raise RetryExceptionError("Database not available")
@@ -1,6 +1,8 @@
 from contextlib import AbstractContextManager
-from typing import Callable, Optional
+from typing import Callable, Iterator, Optional
 
+from sqlalchemy import Column, Table, delete, exists, func, select, true
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import DataError, IntegrityError, OperationalError
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.attributes import InstrumentedAttribute
@@ -12,12 +14,15 @@ from utils.exceptions import RetryExceptionError
 
 
 class Repositiry:
+    """Database access of the services, session_factory is called with write=True by the
+    methods which change data."""
+
     def __init__(self, session_factory: Callable[..., AbstractContextManager[Session]]) -> None:
         self.session_factory = session_factory
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
     def create_obj_in_db(self, obj: type[Base]) -> bool:
-        with self.session_factory() as session:
+        with self.session_factory(write=True) as session:
             try:
                 session.add(obj)
                 session.commit()
@@ -29,11 +34,42 @@ class Repositiry:
                 raise RetryExceptionError("Database not available")
         return True
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
-    def update_obj_in_db(self, obj: type[Base], fileds_to_update: dict, **kwargs) -> bool:
-        with self.session_factory() as session:
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def create_objs_in_db(
+        self, obj: type[Base], values: list[dict], key: InstrumentedAttribute, batch_size: int = 1000
+    ) -> list:
+        """Insert all rows with multi-row INSERT statements in one transaction.
+
+        Returns keys of the rows which conflict with existing rows or with earlier rows of
+        values, nothing is inserted if there are any.
+        """
+        with self.session_factory(write=True) as session:
             try:
-                session.query(obj).filter_by(**kwargs).update(fileds_to_update, synchronize_session="fetch")
+                inserted = set()
+                for start in range(0, len(values), batch_size):
+                    statement = insert(obj).values(values[start : start + batch_size])
+                    inserted.update(session.execute(statement.on_conflict_do_nothing().returning(key)).scalars())
+                conflicts = []
+                for row in values:
+                    if row[key.key] in inserted:
+                        inserted.discard(row[key.key])
+                    else:
+                        conflicts.append(row[key.key])
+                if conflicts:
+                    session.rollback()
+                else:
+                    session.commit()
+            except OperationalError:
+                session.rollback()
+                raise RetryExceptionError("Database not available")
+        return conflicts
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def update_obj_in_db(self, obj: type[Base], fileds_to_update: dict, *criteria, **kwargs) -> bool:
+        with self.session_factory(write=True) as session:
+            try:
+                query = session.query(obj).filter_by(**kwargs).filter(*criteria)
+                query.update(fileds_to_update, synchronize_session="fetch")
                 session.commit()
             except IntegrityError:
                 session.rollback()
@@ -43,7 +79,7 @@ class Repositiry:
                 raise RetryExceptionError("Database not available")
         return True
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
     def get_object_by_field(self, obj: type[Base], **kwargs) -> Optional[Base]:
         with self.session_factory() as session:
             try:
@@ -52,30 +88,72 @@ class Repositiry:
                 raise RetryExceptionError("Database not available")
         return obj_instance
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
-    def get_objects_by_field(self, obj: type[Base], **kwargs) -> Optional[Base]:
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def get_objects_by_field(
+        self,
+        obj: type[Base],
+        *criteria,
+        order_by: tuple = (),
+        offset: Optional[int] = None,
+        limit: Optional[int] = None,
+        **kwargs,
+    ) -> list[Base]:
         with self.session_factory() as session:
             try:
-                if kwargs:
-                    obj_instance = session.query(obj).filter_by(**kwargs)
-                else:
-                    obj_instance = session.query(obj).all()
+                query = session.query(obj).filter_by(**kwargs).filter(*criteria).order_by(*order_by)
+                return query.offset(offset).limit(limit).all()
             except OperationalError:
                 raise RetryExceptionError("Database not available")
-        return obj_instance
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
-    def get_joined_objects_by_field(self, obj: type[Base], joined_obj: InstrumentedAttribute) -> Optional[Base]:
+    def stream_objects(
+        self, obj: type[Base], *criteria, order_by: tuple = (), batch_size: int = 1000, **kwargs
+    ) -> Iterator[Base]:
+        """Yield objects fetched through a server-side cursor, batch_size rows at a time."""
+        with self.session_factory() as session:
+            query = session.query(obj).filter_by(**kwargs).filter(*criteria).order_by(*order_by)
+            yield from query.execution_options(stream_results=True).yield_per(batch_size)
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def get_object_with_related_values(
+        self,
+        obj: type[Base],
+        relationship: InstrumentedAttribute,
+        related_field: InstrumentedAttribute,
+        *criteria,
+        select_from: Optional[type[Base]] = None,
+        join: Optional[InstrumentedAttribute] = None,
+    ) -> tuple[Optional[Base], list]:
+        """Return the object matching criteria and one column of its related objects, aggregated
+        into a list by the same query.
+
+        The object can be looked up through another table: select_from it and join the object
+        with the join relationship.
+        """
+        values = func.array_agg(related_field).filter(related_field.isnot(None))
         with self.session_factory() as session:
             try:
-                objs = session.query(obj).join(joined_obj)
+                query = session.query(obj, values)
+                if select_from is not None:
+                    query = query.select_from(select_from).join(join)
+                row = query.outerjoin(relationship).filter(*criteria).group_by(obj.id).one_or_none()
             except OperationalError:
                 raise RetryExceptionError("Database not available")
-        return objs
+        if row is None:
+            return None, []
+        return row[0], row[1] or []
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
-    def delete_object_by_field(self, obj: type[Base], **kwargs) -> bool:
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def get_aggregates(self, group_by: tuple, aggregates: tuple, *criteria) -> list:
         with self.session_factory() as session:
+            try:
+                query = session.query(*group_by, *aggregates).filter(*criteria)
+                return query.group_by(*group_by).order_by(*group_by).all()
+            except OperationalError:
+                raise RetryExceptionError("Database not available")
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def delete_object_by_field(self, obj: type[Base], **kwargs) -> bool:
+        with self.session_factory(write=True) as session:
             try:
                 obj = session.query(obj).filter_by(**kwargs).one_or_none()
                 if not obj:
@@ -87,7 +165,7 @@ class Repositiry:
                 raise RetryExceptionError("Database not available")
             return True
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
     def add_many_to_many_row(
         self,
         main_obj: type[Base],
@@ -96,26 +174,31 @@ class Repositiry:
         related_values: list,
         update_field: str,
     ) -> bool:
-        with self.session_factory() as session:
+        """Link related objects with one multi-row INSERT into the association table.
+
+        Links that already exist are kept as they are. Nothing is linked and False is returned
+        if the main object or any of the related objects does not exist.
+        """
+        table, main_column, related_column = self._association(main_obj, update_field)
+        related_values = list(dict.fromkeys(related_values))
+        with self.session_factory(write=True) as session:
             try:
-                m_obj = session.query(main_obj).filter_by(id=main_id).one_or_none()
-                if not m_obj:
+                if not self._many_to_many_exists(session, main_obj, main_id, related_obj, related_values):
                     session.rollback()
                     return False
-                for related_value in related_values:
-                    r_obj = session.query(related_obj).filter_by(id=related_value).one_or_none()
-                    if not r_obj:
-                        session.rollback()
-                        return False
-                    getattr(m_obj, update_field).append(r_obj)
-                session.add(m_obj)
+                if related_values:
+                    rows = [{main_column.name: main_id, related_column.name: value} for value in related_values]
+                    session.execute(insert(table).values(rows).on_conflict_do_nothing())
                 session.commit()
+            except (DataError, IntegrityError):
+                session.rollback()
+                return False
             except OperationalError:
                 session.rollback()
                 raise RetryExceptionError("Database not available")
             return True
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
     def remove_many_to_many_row(
         self,
         main_obj: type[Base],
@@ -124,29 +207,133 @@ class Repositiry:
         related_values: list,
         update_field: str,
     ) -> bool:
-        with self.session_factory() as session:
+        """Unlink related objects with one DELETE from the association table.
+
+        Malformed related ids are skipped. Nothing is unlinked and False is returned if the main
+        object or any of the other related objects does not exist.
+        """
+        table, main_column, related_column = self._association(main_obj, update_field)
+        related_values = list(dict.fromkeys(self._well_formed_ids(related_obj, related_values)))
+        with self.session_factory(write=True) as session:
             try:
-                m_obj = session.query(main_obj).filter_by(id=main_id).one_or_none()
-                if not m_obj:
+                if not self._many_to_many_exists(session, main_obj, main_id, related_obj, related_values):
                     session.rollback()
                     return False
-                for related_value in related_values:
-                    try:
-                        r_obj = session.query(related_obj).filter_by(id=related_value).one_or_none()
-                    except DataError:
-                        continue
-                    if not r_obj:
-                        session.rollback()
-                        return False
-                    getattr(m_obj, update_field).remove(r_obj)
-                session.add(m_obj)
+                if related_values:
+                    session.execute(
+                        delete(table).where(main_column == main_id, related_column.in_(related_values))
+                    )
                 session.commit()
             except OperationalError:
                 session.rollback()
                 raise RetryExceptionError("Database not available")
             return True
 
-    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def get_many_to_many_values(
+        self, main_obj: type[Base], main_id: str, related_field: InstrumentedAttribute, update_field: str
+    ) -> list:
+        """Return one column of the objects related to the main one.
+
+        Only the association table is read for related ids, and the related objects' table is
+        joined for any other column.
+        """
+        table, main_column, related_column = self._association(main_obj, update_field)
+        with self.session_factory() as session:
+            try:
+                if related_column.references(related_field.property.columns[0]):
+                    query = session.query(related_column)
+                else:
+                    query = session.query(related_field).join(table, related_column == related_field.class_.id)
+                return [value for (value,) in query.filter(main_column == main_id)]
+            except OperationalError:
+                raise RetryExceptionError("Database not available")
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def bulk_add_many_to_many_rows(
+        self,
+        main_obj: type[Base],
+        main_ids: list,
+        related_obj: type[Base],
+        related_values: list,
+        update_field: str,
+    ) -> set:
+        """Link every existing main object with every existing related one in one statement.
+
+        Returns ids of the main objects which got new links.
+        """
+        table, main_column, related_column = self._association(main_obj, update_field)
+        rows = select(main_obj.id, related_obj.id).join_from(main_obj, related_obj, true())
+        rows = rows.where(main_obj.id.in_(main_ids), related_obj.id.in_(related_values))
+        statement = insert(table).from_select([main_column.name, related_column.name], rows)
+        statement = statement.on_conflict_do_nothing().returning(main_column)
+        return self._execute_returning(statement)
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def bulk_remove_many_to_many_rows(
+        self,
+        main_obj: type[Base],
+        main_ids: list,
+        related_obj: type[Base],
+        related_values: list,
+        update_field: str,
+    ) -> set:
+        """Unlink the main objects from the related ones in one statement.
+
+        Returns ids of the main objects which lost links.
+        """
+        table, main_column, related_column = self._association(main_obj, update_field)
+        statement = delete(table).where(main_column.in_(main_ids), related_column.in_(related_values))
+        return self._execute_returning(statement.returning(main_column))
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
+    def count_objects(self, obj: type[Base], *criteria) -> int:
+        with self.session_factory() as session:
+            try:
+                return session.query(func.count()).select_from(obj).filter(*criteria).scalar()
+            except OperationalError:
+                raise RetryExceptionError("Database not available")
+
+    def _execute_returning(self, statement) -> set:
+        with self.session_factory(write=True) as session:
+            try:
+                returned = set(session.execute(statement).scalars())
+                session.commit()
+            except OperationalError:
+                session.rollback()
+                raise RetryExceptionError("Database not available")
+        return returned
+
+    @staticmethod
+    def _association(main_obj: type[Base], update_field: str) -> tuple[Table, Column, Column]:
+        relation = getattr(main_obj, update_field).property
+        ((_, main_column),) = relation.synchronize_pairs
+        ((_, related_column),) = relation.secondary_synchronize_pairs
+        return relation.secondary, main_column, related_column
+
+    @staticmethod
+    def _many_to_many_exists(
+        session: Session, main_obj: type[Base], main_id: str, related_obj: type[Base], related_values: list
+    ) -> bool:
+        main_exists = exists().where(main_obj.id == main_id)
+        found, related_count = (
+            session.query(main_exists, func.count(related_obj.id)).filter(related_obj.id.in_(related_values)).one()
+        )
+        return found and related_count == len(related_values)
+
+    @staticmethod
+    def _well_formed_ids(obj: type[Base], values: list) -> list:
+        """Return the values the id column of obj can hold, converted to its type."""
+        id_type = obj.id.type.python_type
+        well_formed = []
+        for value in values:
+            try:
+                well_formed.append(value if isinstance(value, id_type) else id_type(str(value)))
+            except ValueError:
+                continue
+        return well_formed
+
+    @backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="postgres")
     def refresh_object(self, obj: Base) -> Base:
         with self.session_factory() as session:
             return session.refresh(obj)
@@ -1,5 +1,5 @@
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import NamedTuple, Optional, Union
 
 import pyotp
@@ -8,6 +8,7 @@ from flask_jwt_extended import get_jti
 from core.config import config
 from db.cache import Caches
 from models.db_models import User, UserAccessHistory
+from repository.access_history import AccessHistoryWriter
 from repository.repository import Repositiry
 from utils.exceptions import ObjectDoesNotExistError, TotpNotSyncError
 from utils.tokens import Token, get_token
@@ -26,12 +27,15 @@ class RedisUser(NamedTuple):
     totp_active: str
     required_fields: list
     roles: list
+    login_date: Optional[str] = None
+    epoch: Optional[int] = None
 
 
 class RequestService:
-    def __init__(self, repository: Repositiry, cache: Caches) -> None:
+    def __init__(self, repository: Repositiry, cache: Caches, history_writer: AccessHistoryWriter) -> None:
         self.cache = cache
         self.repository = repository
+        self.history_writer = history_writer
 
     def check_refresh_token(self, jwt: dict, user_id: str) -> bool:
         key = jwt.get("jti")
@@ -40,11 +44,22 @@ class RequestService:
             return False
         return True
 
+    def get_epoch(self, user_id: str) -> int:
+        return self.cache.revocations.get_epoch(user_id)
+
     def generate_tokens(
-        self, user_id: str, is_superuser: Union[bool, int], roles: list, required_fields: Optional[list] = None
+        self,
+        user_id: str,
+        is_superuser: Union[bool, int],
+        roles: list,
+        required_fields: Optional[list] = None,
+        epoch: Optional[int] = None,
     ) -> Token:
+        """Issue tokens with roles read after the epoch, which is read now if it is not given."""
         required_fields = required_fields or []
-        token = get_token(user_id, is_superuser, roles, required_fields)
+        if epoch is None:
+            epoch = self.get_epoch(user_id)
+        token = get_token(user_id, is_superuser, roles, required_fields, epoch)
         self.cache.refresh_cache.set_value(name=str(get_jti(token.refresh_token)), value=user_id, ex=config.refresh_ttl)
         return token
 
@@ -79,22 +94,31 @@ class RequestService:
     def check_totp(self, request_id: str, code: str) -> Token:
         user = self.get_user_data_from_cache(request_id)
         if not user.totp_active:
-            return self.generate_tokens(user.id, user.is_superuser, user.roles, user.required_fields)
+            return self.generate_tokens(user.id, user.is_superuser, user.roles, user.required_fields, user.epoch)
 
         if not user.totp_sync:
-            self.update_login_attempt(request_id)
+            self.update_login_attempt(request_id, user.login_date)
             raise TotpNotSyncError
 
         totp = pyotp.TOTP(user.totp_secret)
         if not totp.verify(code):
-            self.update_login_attempt(request_id)
+            self.update_login_attempt(request_id, user.login_date)
             raise ObjectDoesNotExistError
-        return self.generate_tokens(user.id, user.is_superuser, user.roles, user.required_fields)
-
-    def update_login_attempt(self, request_id: str):
-        self.repository.update_obj_in_db(
-            UserAccessHistory,
-            {"totp_status": False},
-            request_id=request_id,
-            login_date=datetime.now().strftime("%Y-%m-%d"),
-        )
+        return self.generate_tokens(user.id, user.is_superuser, user.roles, user.required_fields, user.epoch)
+
+    def update_login_attempt(self, request_id: str, login_date: Optional[str] = None):
+        """Mark the login attempt of request_id as failed on TOTP.
+
+        The login date is the partition key, an exact match touches one partition and one row of
+        the (request_id, login_date) index. Request data cached without it only lives request_ttl
+        seconds, so the attempt is searched in that window. An attempt still waiting in the
+        history buffer is updated there.
+        """
+        if self.history_writer.update_record(request_id, {"totp_status": False}):
+            return
+        if login_date:
+            criteria = [UserAccessHistory.login_date == datetime.fromisoformat(login_date)]
+        else:
+            window_start = datetime.now(timezone.utc) - timedelta(seconds=config.request_ttl)
+            criteria = [UserAccessHistory.login_date >= window_start]
+        self.repository.update_obj_in_db(UserAccessHistory, {"totp_status": False}, *criteria, request_id=request_id)
@@ -1,25 +1,42 @@
 from typing import Optional
 
-from models.db_models import Role
+from core.config import config
+from db.cache import Caches
+from db.db import after_commit
+from models.db_models import Role, User
 from repository.repository import Repositiry
 
 
 class RoleService:
-    def __init__(self, repository: Repositiry) -> None:
+    def __init__(self, repository: Repositiry, cache: Caches) -> None:
         self.repository = repository
+        self.cache = cache
 
-    def create_roles(self, roles: list) -> bool:
-        for role in roles:
-            role = Role(role=role["role"], description=role["description"])
-            if not self.repository.create_obj_in_db(role):
-                return False
-        return True
+    def create_roles(self, roles: list) -> list:
+        """Create all roles or none of them, return names of the roles which already exist."""
+        values = [{"role": role["role"], "description": role["description"]} for role in roles]
+        return self.repository.create_objs_in_db(Role, values, Role.role)
 
     def get_roles(self) -> Optional[Role]:
         return self.repository.get_objects_by_field(Role)
 
     def delete_role(self, role_id: str) -> bool:
-        return self.repository.delete_object_by_field(Role, id=role_id)
+        user_ids = self.repository.get_many_to_many_values(Role, role_id, User.id, "users")
+        deleted = self.repository.delete_object_by_field(Role, id=role_id)
+        if deleted:
+            self._drop_cached_roles(user_ids)
+        return deleted
 
     def update_role(self, role_id: str, fields: dict) -> bool:
-        return self.repository.update_obj_in_db(Role, fileds_to_update=fields, id=role_id)
+        updated = self.repository.update_obj_in_db(Role, fileds_to_update=fields, id=role_id)
+        if updated and "role" in fields:
+            self._drop_cached_roles(self.repository.get_many_to_many_values(Role, role_id, User.id, "users"))
+        return updated
+
+    def _drop_cached_roles(self, user_ids: list) -> None:
+        user_ids = [str(user_id) for user_id in user_ids]
+        after_commit(lambda: self._delete_cached_roles(user_ids))
+
+    def _delete_cached_roles(self, user_ids: list) -> None:
+        for start in range(0, len(user_ids), config.role_assignment_batch_size):
+            self.cache.roles_cache.invalidate(user_ids[start : start + config.role_assignment_batch_size])
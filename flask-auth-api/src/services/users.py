@@ -1,39 +1,59 @@
 import datetime
 import json
-from dataclasses import asdict, dataclass, fields
-from time import time
-from typing import NamedTuple, Optional
+from dataclasses import asdict, dataclass, field, fields
+from enum import Enum
+from typing import Callable, Iterator, NamedTuple, Optional
 
 from flask import request
 from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
 from flask_jwt_extended.utils import get_jti
-from sqlalchemy import extract
+from jwt import PyJWTError
+from sqlalchemy import func, tuple_
 from sqlalchemy.dialects.postgresql.base import UUID
 
 from core.config import config, logger
 from db.cache import Caches
+from db.db import after_commit
 from db.rabbit import PikaClient
-from models.db_models import Role, SocialAccount, User, UserAccessHistory
+from models.db_models import (
+    LoginStat,
+    Role,
+    SocialAccount,
+    User,
+    UserAccessHistory,
+)
 from models.notification import Message
+from models.users_response_schemas import UserHistorySchema
+from repository.access_history import AccessHistoryWriter
 from repository.repository import Repositiry
 from social.userdata import UserData
 from utils.bitly import get_short_link
 from utils.exceptions import (
     ConflictError,
+    HashingQueueFullError,
     InvalidTokenError,
     LoginPasswordError,
     ObjectDoesNotExistError,
 )
-from utils.password_hashing import generate_random_string, get_password_hash
+from utils.export import serialize_rows
+from utils.pagination import Cursor, encode_cursor
+from utils.password_hashing import (
+    generate_random_string,
+    get_password_hash,
+    password_needs_rehash,
+)
 from utils.tokens import Token, get_token
 from utils.tracing import tracing
-from utils.view_decorators import check_revoked_token
+from utils.view_decorators import check_revoked_token, is_token_revoked
 
 
 @dataclass
 class UserRandomFields:
-    login: str = generate_random_string()
-    password: str = get_password_hash(generate_random_string())
+    login: str = field(default_factory=generate_random_string)
+    password: str = field(
+        default_factory=lambda: get_password_hash(generate_random_string())
+    )
 
 
 class RequestId(NamedTuple):
@@ -42,22 +62,61 @@ class RequestId(NamedTuple):
     token: Optional[Token]
 
 
+class HistoryPage(NamedTuple):
+    items: list[UserAccessHistory]
+    next_cursor: Optional[str]
+
+
+class TokenStatus(Enum):
+    valid = "valid"
+    revoked = "revoked"
+    invalid = "invalid"
+
+
+class TokenCheck(NamedTuple):
+    status: str
+    roles: list
+
+
+class RoleAssignment(NamedTuple):
+    users: int
+    updated: int
+
+
 class BaseUserService:
-    def __init__(self, repository: Repositiry, cache: Caches) -> None:
+    def __init__(
+        self,
+        repository: Repositiry,
+        cache: Caches,
+        history_writer: AccessHistoryWriter,
+    ) -> None:
         self.repository = repository
         self.cache = cache
+        self.history_writer = history_writer
 
     def generate_request_id(
-        self, user: User, request_id: str, required_fields: Optional[list] = None
+        self,
+        user: User,
+        request_id: str,
+        required_fields: Optional[list] = None,
+        login_date: Optional[datetime.datetime] = None,
+        roles: Optional[list] = None,
+        epoch: Optional[int] = None,
     ) -> RequestId:
+        # roles changed after the epoch is read come with a newer epoch, which revokes
+        # tokens carrying the roles read here
+        if epoch is None:
+            epoch = self.cache.revocations.get_epoch(str(user.id))
+        if roles is None:
+            roles = self.get_user_roles(user.id)
         if user.totp_active:
             token = None
             required_fields = required_fields or []
-            self._put_user_data_to_cache(user, request_id, required_fields)
-        else:
-            token = get_token(
-                user.id, user.is_superuser, self.get_user_roles(user.id), []
+            self._put_user_data_to_cache(
+                user, request_id, required_fields, roles, epoch, login_date
             )
+        else:
+            token = get_token(user.id, user.is_superuser, roles, [], epoch)
             self.cache.refresh_cache.set_value(
                 name=str(get_jti(token.refresh_token)),
                 value=str(user.id),
@@ -73,58 +132,71 @@ class BaseUserService:
         status: bool,
         request_id: str,
         social_service: Optional[str] = None,
-    ) -> None:
-        user_agent = request.headers.get("User-Agent")
-        login_attempt = UserAccessHistory(
+    ) -> datetime.datetime:
+        return self.history_writer.add(
             user_id=user_id,
-            user_agent=user_agent,
+            user_agent=request.headers.get("User-Agent"),
             login_status=status,
             request_id=request_id,
             service_name=social_service,
         )
-        self.repository.create_obj_in_db(login_attempt)
 
     def revoke_access_token(self, user_id: str, jti: Optional[str] = None) -> None:
-        if not jti:
-            jti = "all"
-        value = str(time())
-        current_value = self.cache.access_cache.get_value(str(user_id))
-        if current_value:
-            data = json.loads(current_value)
-            data[jti] = value
+        if jti:
+            after_commit(lambda: self.cache.revocations.revoke(str(user_id), jti))
         else:
-            data = {jti: value}
-        self.cache.access_cache.set_value(
-            str(user_id), json.dumps(data), ex=config.refresh_ttl
-        )
+            after_commit(lambda: self.cache.revocations.bump_epoch(str(user_id)))
 
     def _put_user_data_to_cache(
-        self, user: User, request_id: str, required_fields: list
+        self,
+        user: User,
+        request_id: str,
+        required_fields: list,
+        roles: list,
+        epoch: int,
+        login_date: Optional[datetime.datetime] = None,
     ) -> None:
         user_data = user.to_dict()
         user_data["required_fields"] = required_fields
-        user_data["roles"] = self.get_user_roles(user.id)
+        user_data["login_date"] = login_date.isoformat() if login_date else None
+        user_data["roles"] = roles
+        user_data["epoch"] = epoch
         self.cache.request_cache.set_value(
             request_id, json.dumps(user_data), config.request_ttl
         )
 
     def get_user_roles(self, user_id: str) -> list[Optional[str]]:
-        roles = self.repository.get_joined_objects_by_field(Role, User.roles)
-        if roles:
-            return [str(r.role) for r in roles.filter(User.id == user_id).all()]
-        return []
+        """Return names of the user's roles, cached for config.roles_cache_ttl.
+
+        The cache is dropped whenever user's roles are changed or a role is renamed
+        or deleted, roles read before such a change are not cached.
+        """
+        cached_roles, version = self.cache.roles_cache.get(str(user_id))
+        if cached_roles is not None:
+            return cached_roles
+        roles = self.repository.get_many_to_many_values(
+            User, user_id, Role.role, "roles"
+        )
+        self.cache.roles_cache.set(str(user_id), roles, version)
+        return roles
 
 
 class ManageUserService(BaseUserService):
-    def __init__(self, repository: Repositiry, cache: Caches, pika: PikaClient) -> None:
-        super().__init__(repository, cache)
+    def __init__(
+        self,
+        repository: Repositiry,
+        cache: Caches,
+        history_writer: AccessHistoryWriter,
+        pika: PikaClient,
+    ) -> None:
+        super().__init__(repository, cache, history_writer)
         self.pika = pika
 
     @tracing
     def create_user(self, username: str, password: str) -> Optional[str]:
         user = User(login=username, password=get_password_hash(password))
         if self.repository.create_obj_in_db(user):
-            return str(self.repository.get_object_by_field(User, login=username).id)
+            return str(user.id)
 
     def update_user_data(self, user: User, fields: dict) -> None:
         if "password" in fields:
@@ -145,8 +217,17 @@ class ManageUserService(BaseUserService):
         if not user.check_password(password):
             self.log_login_attempt(user.id, False, request_id)
             raise LoginPasswordError
-        self.log_login_attempt(user.id, True, request_id)
-        return self.generate_request_id(user, request_id)
+        if password_needs_rehash(user.password):
+            self._rehash_password(user, password)
+        login_date = self.log_login_attempt(user.id, True, request_id)
+        return self.generate_request_id(user, request_id, login_date=login_date)
+
+    def _rehash_password(self, user: User, password: str) -> None:
+        """Replace a legacy hash, the login goes on with the old one if hashing is busy."""
+        try:
+            self.update_user_data(user, {"password": password})
+        except HashingQueueFullError:
+            logger.info("password rehash of user {0} postponed".format(user.id))
 
     def generate_email_verification_link(self, user_id: str) -> str:
         user = self.get_user(user_id)
@@ -165,6 +246,9 @@ class ManageUserService(BaseUserService):
             content_value=url,
             template_id=config.notificaion_template,
         )
+        after_commit(lambda: self._publish(message))
+
+    def _publish(self, message: Message) -> None:
         with self.pika.rabbit_connection() as conn:
             conn.basic_publish(
                 exchange="", routing_key=config.rabbit_queue, body=message.json()
@@ -174,39 +258,185 @@ class ManageUserService(BaseUserService):
 
 class HistoryUserService(BaseUserService):
     def get_user_history(
-        self, user_id: str, page_num: int, page_items: int, year: int, month: int
-    ) -> Optional[UserAccessHistory]:
-        start = (page_num - 1) * page_items
-        end = start + page_items
-        return self._get_user_history_from_db(user_id, start, end, year, month)
+        self,
+        user_id: str,
+        page_num: int,
+        page_items: int,
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        cursor: Optional[Cursor] = None,
+    ) -> HistoryPage:
+        """Return a page of the user's login history.
+
+        Logins are written in batches, the latest ACCESS_HISTORY_FLUSH_INTERVAL seconds of them
+        may not be listed yet.
+        """
+        start = 0 if cursor else (page_num - 1) * page_items
+        return self._get_user_history_from_db(
+            user_id, start, page_items, date_from, date_to, cursor
+        )
 
     def _get_user_history_from_db(
-        self, user_id: str, start: int, end: int, year: int, month: int
-    ) -> Optional[UserAccessHistory]:
-        user_access_history = self.repository.get_objects_by_field(
-            UserAccessHistory, user_id=user_id
+        self,
+        user_id: str,
+        start: int,
+        page_items: int,
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        cursor: Optional[Cursor],
+    ) -> HistoryPage:
+        criteria = []
+        # plain range predicates let Postgres prune partitions and use the index
+        if date_from:
+            criteria.append(UserAccessHistory.login_date >= date_from)
+        if date_to:
+            criteria.append(UserAccessHistory.login_date < date_to)
+        if cursor:
+            criteria.append(
+                tuple_(UserAccessHistory.login_date, UserAccessHistory.id) < cursor
+            )
+        items = self.repository.get_objects_by_field(
+            UserAccessHistory,
+            *criteria,
+            order_by=(
+                UserAccessHistory.login_date.desc(),
+                UserAccessHistory.id.desc(),
+            ),
+            offset=start,
+            limit=page_items + 1,
+            user_id=user_id,
+        )
+        next_cursor = None
+        if len(items) > page_items:
+            last = items[page_items - 1]
+            next_cursor = encode_cursor(last.login_date, last.id)
+        return HistoryPage(items=items[:page_items], next_cursor=next_cursor)
+
+    def export_history(
+        self,
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        export_format: str,
+        user_id: Optional[str] = None,
+    ) -> Iterator[str]:
+        criteria = []
+        if user_id:
+            criteria.append(UserAccessHistory.user_id == user_id)
+        if date_from:
+            criteria.append(UserAccessHistory.login_date >= date_from)
+        if date_to:
+            criteria.append(UserAccessHistory.login_date < date_to)
+        rows = self.repository.stream_objects(
+            UserAccessHistory,
+            *criteria,
+            order_by=(UserAccessHistory.login_date, UserAccessHistory.id),
+            batch_size=config.history_export_batch_size,
+        )
+        return serialize_rows(rows, UserHistorySchema(), export_format)
+
+    def get_login_stats(
+        self,
+        granularity: str,
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        user_id: Optional[str] = None,
+        login_status: Optional[bool] = None,
+        group_by_user: bool = False,
+    ) -> list:
+        criteria = []
+        if date_from:
+            criteria.append(LoginStat.bucket >= date_from)
+        if date_to:
+            criteria.append(LoginStat.bucket < date_to)
+        if user_id:
+            criteria.append(LoginStat.user_id == user_id)
+        if login_status is not None:
+            criteria.append(LoginStat.login_status == login_status)
+        group_by = (LoginStat.service_name, LoginStat.login_status)
+        if group_by_user:
+            group_by = (LoginStat.user_id, *group_by)
+        if granularity != "provider":
+            bucket = func.date_trunc(granularity, LoginStat.bucket).label("bucket")
+            group_by = (bucket, *group_by)
+        return self.repository.get_aggregates(
+            group_by, (func.sum(LoginStat.count).label("count"),), *criteria
         )
-        if user_access_history:
-            month_user_access_history = user_access_history.filter(
-                extract("month", UserAccessHistory.login_date) == month
-            ).filter(extract("year", UserAccessHistory.login_date) == year)
-            return month_user_access_history.order_by(
-                UserAccessHistory.login_date.desc()
-            ).slice(start, end)
 
 
 class RoleUserService(BaseUserService):
+    def __init__(
+        self,
+        repository: Repositiry,
+        cache: Caches,
+        history_writer: AccessHistoryWriter,
+        bulk_repository: Repositiry,
+    ) -> None:
+        super().__init__(repository, cache, history_writer)
+        self.bulk_repository = bulk_repository
+
     def add_user_roles(self, user_id: str, role_ids: list) -> bool:
-        self.revoke_access_token(user_id)
-        return self.repository.add_many_to_many_row(
+        added = self.repository.add_many_to_many_row(
             User, user_id, Role, role_ids, "roles"
         )
+        if added:
+            after_commit(lambda: self.cache.roles_cache.invalidate([str(user_id)]))
+            self.revoke_access_token(user_id)
+        return added
 
     def remove_user_roles(self, user_id: str, role_ids: list) -> bool:
-        self.revoke_access_token(user_id)
-        return self.repository.remove_many_to_many_row(
+        removed = self.repository.remove_many_to_many_row(
             User, user_id, Role, role_ids, "roles"
         )
+        if removed:
+            after_commit(lambda: self.cache.roles_cache.invalidate([str(user_id)]))
+            self.revoke_access_token(user_id)
+        return removed
+
+    def assign_roles_to_users(
+        self,
+        user_ids: list,
+        role_ids: list,
+        remove: bool = False,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> RoleAssignment:
+        """Add roles to or remove them from many users, config.role_assignment_batch_size users
+        per statement.
+
+        Every batch is committed in its own transaction, independent of the request, and then
+        the cached roles of the users whose roles the batch changed are dropped and their tokens
+        revoked with one pipeline. Not existing users and users which already had the roles are
+        skipped. A run which failed halfway can be repeated, it skips the roles already assigned;
+        users of a batch committed right before the failure keep their cached roles and tokens
+        until roles_cache_ttl and access_ttl pass.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        role_ids = list(dict.fromkeys(role_ids))
+        if self.repository.count_objects(Role, Role.id.in_(role_ids)) != len(role_ids):
+            raise ObjectDoesNotExistError
+        if remove:
+            change_roles = self.bulk_repository.bulk_remove_many_to_many_rows
+        else:
+            change_roles = self.bulk_repository.bulk_add_many_to_many_rows
+
+        updated = 0
+        batch_size = config.role_assignment_batch_size
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start : start + batch_size]
+            changed = change_roles(User, batch, Role, role_ids, "roles")
+            updated += len(changed)
+            self._drop_cached_roles([str(user_id) for user_id in changed])
+            logger.info(
+                "roles of {0}/{1} users processed, {2} changed".format(
+                    start + len(batch), len(user_ids), updated
+                )
+            )
+            if progress:
+                progress(len(batch))
+        return RoleAssignment(users=len(user_ids), updated=updated)
+
+    def _drop_cached_roles(self, user_ids: list) -> None:
+        self.cache.roles_cache.invalidate(user_ids)
+        self.cache.revocations.bump_epochs(user_ids)
 
     def check_user_roles(self, access_token: str) -> list:
         token = decode_token(access_token)
@@ -214,56 +444,96 @@ class RoleUserService(BaseUserService):
             raise InvalidTokenError
         return token["roles"]
 
+    def check_many_user_roles(self, access_tokens: list) -> list[TokenCheck]:
+        tokens = [self._decode_access_token(access_token) for access_token in access_tokens]
+        states = self.cache.revocations.get_many([token["sub"] for token in tokens if token])
+        checks = []
+        for token in tokens:
+            if token is None:
+                checks.append(TokenCheck(TokenStatus.invalid.value, []))
+            elif is_token_revoked(token, states[token["sub"]]):
+                checks.append(TokenCheck(TokenStatus.revoked.value, []))
+            else:
+                checks.append(TokenCheck(TokenStatus.valid.value, token["roles"]))
+        return checks
+
+    def _decode_access_token(self, access_token: str) -> Optional[dict]:
+        try:
+            token = decode_token(access_token)
+        except (PyJWTError, JWTExtendedException):
+            return
+        if token.get("type") != "access":
+            return
+        return token
+
 
 class ManageSocialUserService(BaseUserService):
     def login_via_social_provider(self, user_data: UserData) -> RequestId:
-        social_account = self.repository.get_object_by_field(
-            SocialAccount,
-            social_id=user_data.social_id,
-            social_name=user_data.social_service,
-        )
+        # the user is only known after the query, the epoch clock read before it revokes
+        # tokens carrying the roles read by it once they change
+        epoch = self.cache.revocations.clock()
+        user, roles = self._get_social_user(user_data)
         request_id = generate_random_string()
-        if not social_account:
-            user = self._create_social_account(user_data)
-            required_fields = [field.name for field in fields(UserRandomFields)]
-            return self.generate_request_id(user, request_id, required_fields)
-
-        user = self.repository.get_object_by_field(User, id=social_account.user_id)
         if not user:
-            raise ObjectDoesNotExistError
-        self.log_login_attempt(user.id, True, user_data.social_service)
-        return self.generate_request_id(user, request_id)
+            user, roles, created = self._create_social_account(user_data)
+            if created:
+                login_date = self.log_login_attempt(
+                    user.id, True, request_id, user_data.social_service
+                )
+                required_fields = [field.name for field in fields(UserRandomFields)]
+                return self.generate_request_id(
+                    user, request_id, required_fields, login_date, roles, epoch
+                )
+
+        login_date = self.log_login_attempt(
+            user.id, True, request_id, user_data.social_service
+        )
+        return self.generate_request_id(
+            user, request_id, login_date=login_date, roles=roles, epoch=epoch
+        )
 
     def delete_social_account(self, token: dict, provider: str) -> None:
         user_id = str(token["sub"])
-        self.revoke_access_token(user_id)
         if not self.repository.delete_object_by_field(
             SocialAccount, user_id=user_id, social_name=provider
         ):
             raise ObjectDoesNotExistError
+        self.revoke_access_token(user_id)
+
+    def _get_social_user(self, user_data: UserData) -> tuple[Optional[User], list]:
+        """Return the user of the social account and the names of the user's roles."""
+        return self.repository.get_object_with_related_values(
+            User,
+            User.roles,
+            Role.role,
+            SocialAccount.social_id == user_data.social_id,
+            SocialAccount.social_name == user_data.social_service,
+            select_from=SocialAccount,
+            join=SocialAccount.user,
+        )
 
-    def _create_random_user(self, email: str) -> Optional[User]:
+    def _create_social_account(self, user_data: UserData) -> tuple[User, list, bool]:
+        """Create a random user and the social account in one transaction, return the user,
+        the names of its roles and whether it was created.
+
+        If the same social account was created concurrently its user is returned, only
+        a collision of the random login is retried.
+        """
+        password = get_password_hash(generate_random_string())
         attempts = 3
         while attempts > 0:
-            random_fields = UserRandomFields()
-            user = User(**asdict(random_fields))
-            user.email = email
-            if self.repository.create_obj_in_db(user):
-                return self.repository.get_object_by_field(
-                    User, login=random_fields.login
+            user = User(**asdict(UserRandomFields(password=password)))
+            user.email = user_data.user_email
+            user.social_accounts.append(
+                SocialAccount(
+                    social_id=user_data.social_id,
+                    social_name=user_data.social_service,
                 )
+            )
+            if self.repository.create_obj_in_db(user):
+                return user, [], True
+            existing_user, roles = self._get_social_user(user_data)
+            if existing_user:
+                return existing_user, roles, False
             attempts -= 1
-        return
-
-    def _create_social_account(self, user_data: UserData) -> User:
-        user = self._create_random_user(user_data.user_email)
-        if not user:
-            raise ConflictError
-        social_account = SocialAccount(
-            social_id=user_data.social_id,
-            social_name=user_data.social_service,
-            user_id=user.id,
-        )
-        self.repository.create_obj_in_db(social_account)
-        self.log_login_attempt(user.id, True, user_data.social_service)
-        return user
+        raise ConflictError
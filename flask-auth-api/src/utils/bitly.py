@@ -5,7 +5,7 @@ from utils.decorators import backoff
 from utils.exceptions import RetryExceptionError
 
 
-@backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
+@backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10, breaker="bitly", fallback=lambda url: url)
 def get_short_link(url: str) -> str:
 
     headers = {
@@ -20,6 +20,7 @@ def get_short_link(url: str) -> str:
             "https://api-ssl.bitly.com/v4/shorten",
             headers=headers,
             data=data,
+            timeout=config.bitly_timeout,
         )
     except requests.exceptions.RequestException:
         raise RetryExceptionError("Bitly connection error")
@@ -0,0 +1,66 @@
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+from core.config import config
+from utils.metrics import CIRCUIT_BREAKER_OPEN
+
+
+class CircuitBreaker:
+    """Stop calling a dependency after consecutive failures.
+
+    After ``failure_threshold`` failures in a row the circuit opens and calls fail fast. Once
+    ``reset_timeout`` seconds passed a single trial call is let through, its success closes
+    the circuit and its failure opens it again.
+
+    Args:
+        name: str dependency name
+        failure_threshold: int consecutive failures opening the circuit
+        reset_timeout: float seconds the circuit stays open before a trial call
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+            CIRCUIT_BREAKER_OPEN.labels(self.name).set(0)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
+                CIRCUIT_BREAKER_OPEN.labels(self.name).set(1)
+
+
+breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name, config.circuit_failure_threshold, config.circuit_reset_timeout)
+    return breakers[name]
@@ -1,8 +1,14 @@
 import logging
 from functools import wraps
-from time import sleep
+from random import uniform
+from time import monotonic, sleep
+from typing import Any, Callable, Optional
 
-from utils.exceptions import RetryExceptionError
+from flask import g, has_request_context
+
+from core.config import config
+from utils.circuit_breaker import get_breaker
+from utils.exceptions import DependencyUnavailableError, RetryExceptionError
 
 
 def expo(start_sleep_time, factor, border_sleep_time):
@@ -30,30 +36,74 @@ def expo(start_sleep_time, factor, border_sleep_time):
         sequence_element += 1
 
 
-def backoff(logger: logging.Logger, start_sleep_time: float = 0.1, factor: int = 2, border_sleep_time: int = 10):
-    """Repeat function with exponential delay in case it raises RetryException.
+def get_deadline() -> float:
+    """Return monotonic time the current request has to be answered by.
+
+    Outside of a request every call gets its own budget.
+    """
+    if not has_request_context():
+        return monotonic() + config.request_deadline
+    if "deadline" not in g:
+        g.deadline = monotonic() + config.request_deadline
+    return g.deadline
+
+
+def backoff(
+    logger: logging.Logger,
+    start_sleep_time: float = 0.1,
+    factor: int = 2,
+    border_sleep_time: int = 10,
+    max_attempts: Optional[int] = None,
+    breaker: Optional[str] = None,
+    fallback: Optional[Callable[..., Any]] = None,
+):
+    """Repeat function with full jitter exponential delay in case it raises RetryException.
+
+    Retries stop after max_attempts or when the next delay would outlive the request deadline.
+    Call sites of one dependency share a named circuit breaker, while it is open the function
+    is not called at all. When the dependency stays unavailable fallback is called with the
+    same arguments (fail open), without fallback DependencyUnavailableError is raised (fail closed).
 
     Args:
         start_sleep_time: float start repeat time
         factor: int exponential factor
         border_sleep_time: int exponential limit
+        max_attempts: Optional[int] attempts limit, RETRY_MAX_ATTEMPTS by default
+        breaker: Optional[str] circuit breaker name of the dependency
+        fallback: Optional[Callable] result provider when the dependency is unavailable
     """
 
     def func_wrapper(func):
         @wraps(func)
         def inner(*args, **kwargs):
+            circuit = get_breaker(breaker) if breaker else None
+            attempts = max_attempts or config.retry_max_attempts
+            deadline = get_deadline()
             delays = expo(start_sleep_time, factor, border_sleep_time)
-            func_result = None
-            while True:
+            for attempt in range(1, attempts + 1):
+                if circuit is not None and not circuit.allow():
+                    break
                 try:
                     func_result = func(*args, **kwargs)
                 except RetryExceptionError as e:
                     logger.exception(e)
-                    delay = next(delays)
+                    if circuit is not None:
+                        circuit.record_failure()
+                except Exception:
+                    if circuit is not None:
+                        circuit.record_success()
+                    raise
                 else:
+                    if circuit is not None:
+                        circuit.record_success()
+                    return func_result
+                delay = uniform(0, next(delays))
+                if attempt == attempts or monotonic() + delay > deadline:
                     break
                 sleep(delay)
-            return func_result
+            if fallback is not None:
+                return fallback(*args, **kwargs)
+            raise DependencyUnavailableError(breaker or func.__qualname__)
 
         return inner
 
@@ -28,3 +28,11 @@ class TotpNotSyncError(Exception):
 
 class ProviderAuthTokenError(Exception):
     "Provider failed to decode auth token."
+
+
+class HashingQueueFullError(Exception):
+    "Password hashing pool has no free queue slots."
+
+
+class DependencyUnavailableError(Exception):
+    "Dependency failed after retries or its circuit is open."
@@ -0,0 +1,25 @@
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+
+from marshmallow import Schema
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def serialize_rows(rows: Iterable, schema: Schema, export_format: str) -> Iterator[str]:
+    """Serialize rows one by one as NDJSON lines or CSV records, CSV starts with a header."""
+    if export_format == "ndjson":
+        for row in rows:
+            yield json.dumps(schema.dump(row)) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(schema.fields))
+    writer.writeheader()
+    for row in rows:
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(schema.dump(row))
+    yield buffer.getvalue()
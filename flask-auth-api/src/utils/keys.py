@@ -0,0 +1,184 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from secrets import token_hex
+from time import monotonic, time
+from typing import Any, Optional, Union
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from flask import Flask
+from flask_jwt_extended import JWTManager
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+from core.config import config, logger
+
+SYMMETRIC_ALGORITHM = "HS256"
+RSA_ALGORITHMS = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512")
+EDDSA_ALGORITHM = "EdDSA"
+
+PrivateKey = Union[rsa.RSAPrivateKey, ed25519.Ed25519PrivateKey]
+
+
+@dataclass
+class SigningKey:
+    kid: str
+    private_key: PrivateKey
+    created: float
+
+    @property
+    def public_key(self) -> Any:
+        return self.private_key.public_key()
+
+    def to_jwk(self, algorithm: str) -> dict:
+        if isinstance(self.private_key, ed25519.Ed25519PrivateKey):
+            jwk = json.loads(OKPAlgorithm.to_jwk(self.public_key))
+        else:
+            jwk = json.loads(RSAAlgorithm.to_jwk(self.public_key))
+        jwk.update({"kid": self.kid, "alg": algorithm, "use": "sig"})
+        return jwk
+
+
+class KeyRing:
+    """Asymmetric signing keys stored as ``<kid>.pem`` files in one directory.
+
+    The newest key that has been published for at least ``publish_ahead`` seconds signs new
+    tokens, so verifiers with a cached JWKS already know it. Older keys stay published and
+    keep verifying tokens until ``retire_after`` seconds after a successor took over.
+
+    Args:
+        algorithm: str JWT algorithm, RS* / PS* or EdDSA
+        keys_dir: str directory with PEM encoded private keys
+        active_kid: Optional[str] pin signing to this key id instead of the newest one
+        publish_ahead: int seconds a new key is published before it signs tokens
+        retire_after: int seconds a replaced key stays published
+        reload_interval: int seconds between rescans of keys_dir
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        keys_dir: str,
+        active_kid: Optional[str] = None,
+        publish_ahead: int = 0,
+        retire_after: int = 0,
+        reload_interval: int = 60,
+    ) -> None:
+        self.algorithm = algorithm
+        self.keys_dir = Path(keys_dir)
+        self.active_kid = active_kid
+        self.publish_ahead = publish_ahead
+        self.retire_after = retire_after
+        self.reload_interval = reload_interval
+        self._keys: dict[str, SigningKey] = {}
+        self._loaded_at: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.algorithm != SYMMETRIC_ALGORITHM
+
+    def keys(self) -> list[SigningKey]:
+        if self._loaded_at is None or monotonic() - self._loaded_at > self.reload_interval:
+            self.load()
+        return sorted(self._keys.values(), key=lambda key: (key.created, key.kid))
+
+    def load(self) -> None:
+        keys = {}
+        for path in self.keys_dir.glob("*.pem"):
+            private_key = serialization.load_pem_private_key(path.read_bytes(), password=None)
+            keys[path.stem] = SigningKey(kid=path.stem, private_key=private_key, created=path.stat().st_mtime)
+        self._keys = keys
+        self._loaded_at = monotonic()
+
+    def active(self) -> SigningKey:
+        keys = self.keys()
+        if not keys:
+            raise RuntimeError("no signing keys found in {0}".format(self.keys_dir))
+        if self.active_kid:
+            if self.active_kid not in self._keys:
+                raise RuntimeError("signing key {0} not found in {1}".format(self.active_kid, self.keys_dir))
+            return self._keys[self.active_kid]
+        published = [key for key in keys if key.created + self.publish_ahead <= time()]
+        return published[-1] if published else keys[0]
+
+    def get(self, kid: Optional[str]) -> SigningKey:
+        key = {key.kid: key for key in self.keys()}.get(kid) if kid else None
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown signing key id")
+        return key
+
+    def retired(self) -> list[SigningKey]:
+        keys = self.keys()
+        active = self.active()
+        now = time()
+        return [
+            key
+            for key, successor in zip(keys, keys[1:])
+            if key.kid != active.kid and successor.created + self.publish_ahead + self.retire_after < now
+        ]
+
+    def jwks(self) -> dict:
+        if not self.enabled:
+            return {"keys": []}
+        return {"keys": [key.to_jwk(self.algorithm) for key in self.keys()]}
+
+    def generate(self) -> SigningKey:
+        if self.algorithm == EDDSA_ALGORITHM:
+            private_key = ed25519.Ed25519PrivateKey.generate()
+        elif self.algorithm in RSA_ALGORITHMS:
+            private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        else:
+            raise ValueError("algorithm {0} does not use key pairs".format(self.algorithm))
+        # keys generated within the same second differ in the random suffix
+        kid = "{0}-{1}".format(datetime.utcnow().strftime("%Y%m%d%H%M%S"), token_hex(4))
+        path = self.keys_dir / "{0}.pem".format(kid)
+        self.keys_dir.mkdir(parents=True, exist_ok=True)
+        # "x" refuses to overwrite a key with the same kid instead of replacing it
+        with path.open("xb") as key_file:
+            path.chmod(0o600)
+            key_file.write(
+                private_key.private_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PrivateFormat.PKCS8,
+                    encryption_algorithm=serialization.NoEncryption(),
+                )
+            )
+        self.load()
+        return self._keys[kid]
+
+
+keyring = KeyRing(
+    algorithm=config.jwt_algorithm,
+    keys_dir=config.jwt_keys_dir,
+    active_kid=config.jwt_active_kid,
+    publish_ahead=config.jwks_max_age,
+    retire_after=config.refresh_ttl,
+)
+
+
+def configure_signing_keys(app: Flask, jwt_manager: JWTManager) -> None:
+    if not keyring.enabled:
+        return
+
+    app.config["JWT_ALGORITHM"] = keyring.algorithm
+    decode_algorithms = [keyring.algorithm]
+    if config.jwt_accept_hs256:
+        logger.warning("tokens signed with SECRET are accepted, turn JWT_ACCEPT_HS256 off after REFRESH_TTL")
+        decode_algorithms.append(SYMMETRIC_ALGORITHM)
+    app.config["JWT_DECODE_ALGORITHMS"] = decode_algorithms
+
+    @jwt_manager.additional_headers_loader
+    def add_kid_header(identity: Any) -> dict:
+        return {"kid": keyring.active().kid}
+
+    @jwt_manager.encode_key_loader
+    def encode_key(identity: Any) -> PrivateKey:
+        return keyring.active().private_key
+
+    @jwt_manager.decode_key_loader
+    def decode_key(jwt_header: dict, jwt_data: dict) -> Any:
+        if jwt_header.get("alg") == SYMMETRIC_ALGORITHM:
+            return config.secret
+        return keyring.get(jwt_header.get("kid")).public_key
@@ -0,0 +1,47 @@
+from http import HTTPStatus
+from ipaddress import ip_address, ip_network
+
+from flask import Flask, Response, request
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from core.config import config
+
+HASHING_QUEUE_WAIT = Histogram(
+    "password_hashing_queue_wait_seconds",
+    "Time a password hash waits for a free hashing worker",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+HASHING_QUEUE_DEPTH = Gauge(
+    "password_hashing_queue_depth",
+    "Password hashes waiting for or running in the hashing pool",
+)
+RATE_LIMIT_DECISIONS = Counter(
+    "rate_limit_decisions_total",
+    "Rate limit decisions by where they were made",
+    ["source"],
+)
+CIRCUIT_BREAKER_OPEN = Gauge(
+    "circuit_breaker_open",
+    "Whether calls to a dependency currently fail fast",
+    ["dependency"],
+)
+AFTER_COMMIT_FAILURES = Counter(
+    "after_commit_failures_total",
+    "Cache invalidations and events which failed after their transaction was committed",
+)
+ACCESS_HISTORY_BUFFER_DEPTH = Gauge(
+    "access_history_buffer_depth",
+    "Login records waiting to be written to users_access_history",
+)
+
+
+def configure_metrics(app: Flask) -> None:
+    """Expose metrics at /metrics to clients from METRICS_ALLOWED_NETWORKS, nginx does not proxy it."""
+    allowed_networks = [ip_network(network) for network in config.metrics_allowed_networks]
+
+    @app.route("/metrics")
+    def metrics() -> Response:
+        client = ip_address(request.remote_addr or "0.0.0.0")
+        if not any(client in network for network in allowed_networks):
+            return Response(status=HTTPStatus.FORBIDDEN.value)
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,24 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from uuid import UUID
+
+Cursor = tuple[datetime, UUID]
+
+
+def encode_cursor(login_date: datetime, obj_id: UUID) -> str:
+    raw = json.dumps([login_date.isoformat(), str(obj_id)]).encode()
+    return urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Decode a cursor made by encode_cursor.
+
+    Raises:
+        ValueError: cursor is malformed
+    """
+    try:
+        login_date, obj_id = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(login_date), UUID(obj_id)
+    except (TypeError, ValueError) as error:
+        raise ValueError("Invalid cursor") from error
@@ -1,17 +1,89 @@
 import string
 from secrets import choice as secrets_choice
+from time import perf_counter
+from typing import Any, Callable, Optional
 
+from gevent.monkey import is_module_patched
+from gevent.threadpool import ThreadPool
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from core.config import config
+from utils.exceptions import HashingQueueFullError
+from utils.metrics import HASHING_QUEUE_DEPTH, HASHING_QUEUE_WAIT
+
+# Hashes of imported users may use legacy schemes, they are verified and replaced by bcrypt on login
+pwd_context = CryptContext(schemes=["bcrypt", *config.password_legacy_schemes], deprecated="auto")
+
+
+class HashingExecutor:
+    """Run password hashing in native threads so the gevent hub keeps serving requests.
+
+    bcrypt releases the GIL while hashing, so a pool sized to the cores hashes in parallel
+    while the request greenlet waits cooperatively. Without gevent patching (CLI commands)
+    hashing runs inline.
+
+    Args:
+        workers: int number of native hashing threads
+        max_queue: int hashes allowed to wait for or run in the pool at once
+    """
+
+    def __init__(self, workers: int, max_queue: int) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self._pool: Optional[ThreadPool] = None
+
+    def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if not is_module_patched("threading"):
+            return func(*args)
+        if self.pending >= self.max_queue:
+            raise HashingQueueFullError
+        self.pending += 1
+        HASHING_QUEUE_DEPTH.set(self.pending)
+        try:
+            waited, result = self._get_pool().apply(self._timed, (func, perf_counter(), *args))
+        finally:
+            self.pending -= 1
+            HASHING_QUEUE_DEPTH.set(self.pending)
+        HASHING_QUEUE_WAIT.observe(waited)
+        return result
+
+    def _get_pool(self) -> ThreadPool:
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        return self._pool
+
+    @staticmethod
+    def _timed(func: Callable[..., Any], queued_at: float, *args: Any) -> tuple[float, Any]:
+        waited = perf_counter() - queued_at
+        return waited, func(*args)
+
+
+hashing_executor = HashingExecutor(config.hashing_workers, config.hashing_queue_size)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return hashing_executor.run(pwd_context.verify, plain_password, hashed_password)
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return hashing_executor.run(pwd_context.hash, password)
+
+
+def is_password_hash(value: str) -> bool:
+    """Return True if value is a complete, well-formed hash of one of pwd_context's schemes."""
+    scheme = pwd_context.identify(value, required=False)
+    if scheme is None:
+        return False
+    try:
+        parsed = pwd_context.handler(scheme).from_string(value)
+    except ValueError:
+        return False
+    return parsed.checksum is not None
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
 
 
 def generate_random_string():
@@ -1,53 +1,238 @@
-import datetime
+import math
+from dataclasses import dataclass
+from enum import Enum
 from functools import wraps
 from http import HTTPStatus
+from threading import Lock
+from time import monotonic
+from typing import NamedTuple, Optional
 
 from flask import request
 from flask.helpers import make_response
 from flask.json import jsonify
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
 from redis import ConnectionError, ConnectionPool, Redis
 
 from core.config import config, logger
 from core.msg import Msg
+from db.local_cache import LocalCache
 from models.users_response_schemas import MsgSchema
 from utils.decorators import backoff
 from utils.exceptions import RetryExceptionError
+from utils.metrics import RATE_LIMIT_DECISIONS
 
 REDIS_CONN = Redis(connection_pool=ConnectionPool(host=config.redis_host, port=config.redis_port, db=5))
 
+# Token bucket refilled continuously at capacity / period tokens per second.
+# Server time is used so that all workers and nodes share one clock.
+# A call returns unused tokens of the previous lease and leases up to the requested amount.
+TOKEN_BUCKET_SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local requested = tonumber(ARGV[3])
+    local returned = tonumber(ARGV[4])
+    local time = redis.call("TIME")
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate + returned)
+    local granted = math.min(requested, math.floor(tokens))
+    tokens = tokens - granted
+    redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+    redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate))
+    return {granted, tostring(tokens)}
+"""
+token_bucket = REDIS_CONN.register_script(TOKEN_BUCKET_SCRIPT)
 
-def rate_limiting(requests_limit: int = 20, limit_expire_period: int = 60):
-    """Limit requests per received limit period.
+
+class RateLimitKey(Enum):
+    ip = "ip"
+    user = "user"
+    login = "login"
+
+
+class RateLimit(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: int
+    retry_after: int
+
+    @property
+    def headers(self) -> dict:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+@dataclass
+class Lease:
+    tokens: int
+    remote_tokens: float
+    limit: int
+    rate: float
+    synced_at: float
+    denied_until: float = 0
+
+    def rate_limit(self, allowed: bool) -> RateLimit:
+        tokens = self.remote_tokens + self.tokens
+        return RateLimit(
+            allowed=allowed,
+            limit=self.limit,
+            remaining=math.floor(tokens),
+            reset=math.ceil((self.limit - tokens) / self.rate),
+            retry_after=max(1, math.ceil(self.denied_until - monotonic())),
+        )
+
+
+class RateLimiter:
+    """Token buckets in Redis fronted by per-worker leases.
+
+    A worker takes ``lease_ratio`` of a limit from the shared bucket in one script call and
+    admits requests from the lease locally until it runs out or ``sync_interval`` passes. The
+    next call gives unused tokens back and takes a new lease. A client without tokens is refused
+    locally until the shared bucket refills one, so neither allowed nor refused requests hit
+    Redis every time, while a worker never holds more than its lease above the global limit.
+
+    Args:
+        lease_ratio: float share of a limit leased by a worker at once
+        sync_interval: float seconds a lease is used before it is synced with Redis
+        maxsize: int maximum number of leases kept by a worker
+    """
+
+    def __init__(self, lease_ratio: float, sync_interval: float, maxsize: int) -> None:
+        self.lease_ratio = lease_ratio
+        self.sync_interval = sync_interval
+        self._leases = LocalCache(maxsize=maxsize, ttl=math.inf)
+        self._lock = Lock()
+
+    def acquire(self, key: str, limit: int, period: int) -> RateLimit:
+        now = monotonic()
+        with self._lock:
+            lease = self._leases.get(key)
+            returned = 0
+            if lease is not None:
+                if now - lease.synced_at < self.sync_interval and (lease.tokens or lease.denied_until > now):
+                    RATE_LIMIT_DECISIONS.labels("local").inc()
+                    if not lease.tokens:
+                        return lease.rate_limit(allowed=False)
+                    lease.tokens -= 1
+                    return lease.rate_limit(allowed=True)
+                returned, lease.tokens = lease.tokens, 0
+
+        RATE_LIMIT_DECISIONS.labels("redis").inc()
+        rate = limit / period
+        granted, remote_tokens = take_tokens(
+            limit_key=key,
+            request_limit=limit,
+            rate=rate,
+            requested=max(1, int(limit * self.lease_ratio)),
+            returned=returned,
+        )
+        synced_at = monotonic()
+        lease = Lease(
+            tokens=max(0, granted - 1),
+            remote_tokens=remote_tokens,
+            limit=limit,
+            rate=rate,
+            synced_at=synced_at,
+            denied_until=0 if granted else synced_at + (1 - remote_tokens) / rate,
+        )
+        with self._lock:
+            concurrent = self._leases.get(key)
+            if concurrent is not None:
+                lease.tokens += concurrent.tokens
+            self._leases.set(key, lease)
+        return lease.rate_limit(granted > 0)
+
+
+rate_limiter = RateLimiter(
+    lease_ratio=config.rate_limit_lease_ratio,
+    sync_interval=config.rate_limit_sync_interval,
+    maxsize=config.rate_limit_local_size,
+)
+
+
+def rate_limiting(requests_limit: int = 20, limit_expire_period: int = 60, key: RateLimitKey = RateLimitKey.ip):
+    """Limit requests per received limit period with a token bucket per endpoint and client.
+
+    Limits can be overridden per endpoint with RATE_LIMITS env, e.g. {"users.login": [5, 60]}.
+    Logins are counted per login and per client IP, so neither trying many passwords for one
+    login nor one password for many logins gets past the limit. The IP bucket is checked first
+    and a request is refused when either bucket is empty.
 
     Args:
         requests_limit: int requests limit
         limit_expire_period: int limit period
+        key: RateLimitKey client identity the limit is counted for
     """
 
     def wrapper(func):
         @wraps(func)
         def inner(*args, **kwargs):
-            if requests_is_limited(request_limit=requests_limit, limit_key_expire_period=limit_expire_period):
-                return make_response(
+            limit, period = config.rate_limits.get(request.endpoint, (requests_limit, limit_expire_period))
+            rate_limit = None
+            for limit_key in (RateLimitKey.ip, key) if key == RateLimitKey.login else (key,):
+                bucket = rate_limiter.acquire(
+                    key="rate:{0}:{1}:{2}".format(request.endpoint, limit_key.value, get_limit_key(limit_key)),
+                    limit=limit,
+                    period=period,
+                )
+                if rate_limit is None or not bucket.allowed or bucket.remaining < rate_limit.remaining:
+                    rate_limit = bucket
+                if not bucket.allowed:
+                    break
+            if not rate_limit.allowed:
+                response = make_response(
                     jsonify(MsgSchema().load(Msg.rate_limit.value)), HTTPStatus.TOO_MANY_REQUESTS.value
                 )
-            return func(*args, **kwargs)
+            else:
+                response = make_response(func(*args, **kwargs))
+            response.headers.extend(rate_limit.headers)
+            return response
 
         return inner
 
     return wrapper
 
 
-@backoff(logger, start_sleep_time=0.1, factor=2, border_sleep_time=10)
-def requests_is_limited(request_limit, limit_key_expire_period):
-    request_ip = request.headers.get("X-Real-IP")
-    now = datetime.datetime.now()
-    key = f"{request_ip}:{now.minute}"
+def get_limit_key(key: RateLimitKey) -> Optional[str]:
+    if key == RateLimitKey.user:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+        if identity:
+            return identity
+    if key == RateLimitKey.login:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and body.get("login"):
+            return str(body["login"])
+    return request.headers.get("X-Real-IP", request.remote_addr)
+
+
+def admit_without_redis(
+    limit_key: str, request_limit: int, rate: float, requested: int, returned: int
+) -> tuple[int, float]:
+    return 1, 0.0
+
+
+@backoff(
+    logger,
+    start_sleep_time=0.1,
+    factor=2,
+    border_sleep_time=10,
+    max_attempts=1,
+    breaker="redis",
+    fallback=admit_without_redis if config.rate_limit_fail_open else None,
+)
+def take_tokens(limit_key: str, request_limit: int, rate: float, requested: int, returned: int) -> tuple[int, float]:
     try:
-        pipe = REDIS_CONN.pipeline()
-        pipe.incr(key, 1)
-        pipe.expire(key, limit_key_expire_period)
-        result = pipe.execute()
+        granted, tokens = token_bucket(keys=[limit_key], args=[request_limit, rate, requested, returned])
     except ConnectionError:
         raise RetryExceptionError("Redis not available")
-    return result[0] > request_limit
+    return int(granted), float(tokens)
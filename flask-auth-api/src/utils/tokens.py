@@ -9,13 +9,15 @@ class Token(NamedTuple):
     required_fields: list
 
 
-def get_token(user_id: str, is_superuser: Union[bool, int], roles: list, required_fields: list) -> Token:
+def get_token(
+    user_id: str, is_superuser: Union[bool, int], roles: list, required_fields: list, epoch: int = 0
+) -> Token:
     access_token = create_access_token(
         identity=user_id,
-        additional_claims={"roles": roles, "admin": int(is_superuser)},
+        additional_claims={"roles": roles, "admin": int(is_superuser), "epoch": epoch},
     )
     refresh_token = create_refresh_token(
         identity=user_id,
-        additional_claims={"related_access_token": get_jti(access_token), "admin": int(is_superuser)},
+        additional_claims={"related_access_token": get_jti(access_token), "admin": int(is_superuser), "epoch": epoch},
     )
     return Token(access_token, refresh_token, required_fields)
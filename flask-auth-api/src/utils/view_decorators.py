@@ -1,4 +1,3 @@
-import json
 import os
 from functools import wraps
 from http import HTTPStatus
@@ -8,7 +7,7 @@ from flask_jwt_extended import get_jwt, verify_jwt_in_request
 
 from core.config import config
 from core.msg import Msg
-from db.cache import Caches
+from db.cache import Caches, RevocationState
 from models.users_response_schemas import MsgSchema
 
 caches = Caches()
@@ -36,22 +35,24 @@ def jwt_verification(superuser_only=False):
 
 
 def check_revoked_token(token: dict) -> bool:
+    return is_token_revoked(token, caches.revocations.get(token["sub"]))
+
+
+def is_token_revoked(token: dict, state: RevocationState) -> bool:
+    if token.get("epoch", 0) < state.epoch:
+        return True
     if "related_access_token" in token:
         access_token = token["related_access_token"]
         exp = token["exp"] - config.refresh_ttl
     else:
         access_token = token["jti"]
         exp = token["exp"] - config.access_ttl
-    revoked_tokens = caches.access_cache.get_value(token["sub"])
-    if not revoked_tokens:
-        return False
-    revoked_tokens = json.loads(revoked_tokens)
-    if "all" in revoked_tokens:
-        return exp <= float(revoked_tokens["all"])
-    token_revoke_time = revoked_tokens.get(access_token, None)
-    if token_revoke_time is None:
-        return False
-    return exp <= float(token_revoke_time)
+    # "all" only comes from revocations stored before epochs, see RevocationCache
+    for revoked in (access_token, "all"):
+        token_revoke_time = state.revoked_tokens.get(revoked, None)
+        if token_revoke_time is not None and exp <= float(token_revoke_time):
+            return True
+    return False
 
 
 def revoked_token_check():
@@ -1,4 +1,6 @@
 import asyncio
+import subprocess
+import sys
 from dataclasses import dataclass
 from typing import Optional
 
@@ -7,6 +9,7 @@ import jwt
 import pytest
 import pytest_asyncio
 from multidict import CIMultiDictProxy
+from settings import config
 
 
 @dataclass
@@ -56,6 +59,20 @@ def make_get_request_no_body(web_client):
     return inner
 
 
+@pytest.fixture
+def make_get_request_text(web_client):
+    async def inner(url: str, params: Optional[dict] = None, headers: Optional[dict] = None) -> HTTPResponse:
+        params = params or {}
+        async with web_client.get(url, params=params, headers=headers) as response:
+            return HTTPResponse(
+                body=await response.text(),
+                headers=response.headers,
+                status=response.status,
+            )
+
+    return inner
+
+
 @pytest.fixture
 def make_post_request(web_client):
     async def inner(
@@ -122,3 +139,27 @@ def prepare_user(make_post_request):
         return headers_access, headers_refresh, uuid
 
     return inner
+
+
+@pytest.fixture
+def wait_for_history():
+    async def inner():
+        # login records are written in batches, the API lists them once they are flushed
+        await asyncio.sleep(config.access_history_flush_interval + 1)
+
+    return inner
+
+
+@pytest.fixture
+def run_flask_command():
+    def inner(*args: str, input_data: Optional[str] = None) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, "-m", "flask", *args],
+            cwd=config.api_src_dir,
+            input=input_data,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+    return inner
@@ -1,7 +1,12 @@
+import sys
+from contextlib import contextmanager
+
 import psycopg2
 import pytest
 from psycopg2.extras import DictCursor
 from settings import config
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
 
 
 @pytest.fixture(scope="function")
@@ -16,7 +21,7 @@ def clear_db_tables():
     )
     cur = connect.cursor()
     cur.execute(
-        "DELETE from users_access_history;delete from user_roles;delete from roles;DELETE from social_account; delete from users"
+        "DELETE from users_access_history;delete from login_stats;delete from user_roles;delete from roles;DELETE from social_account; delete from users"
     )
     cur.close()
     connect.commit()
@@ -41,3 +46,96 @@ def make_superuser():
         connect.close()
 
     return inner
+
+
+@pytest.fixture(scope="function")
+def fetch_from_db():
+    def inner(query: str, params: dict) -> list:
+        connect = psycopg2.connect(
+            dbname=config.pg_db,
+            host=config.pg_host,
+            port=config.pg_port,
+            user=config.pg_user,
+            password=config.pg_password,
+            cursor_factory=DictCursor,
+        )
+        cur = connect.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cur.close()
+        connect.close()
+        return rows
+
+    return inner
+
+
+def plan_relations(plan: dict) -> set:
+    relations = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for subplan in plan.get("Plans", []):
+        relations |= plan_relations(subplan)
+    return relations
+
+
+@pytest.fixture(scope="function")
+def explain():
+    def inner(query: str, params: dict) -> set:
+        connect = psycopg2.connect(
+            dbname=config.pg_db,
+            host=config.pg_host,
+            port=config.pg_port,
+            user=config.pg_user,
+            password=config.pg_password,
+        )
+        cur = connect.cursor()
+        cur.execute("EXPLAIN (FORMAT JSON) {0}".format(query), params)
+        plan = cur.fetchone()[0][0]["Plan"]
+        cur.close()
+        connect.close()
+        return plan_relations(plan)
+
+    return inner
+
+
+def import_api_sources() -> None:
+    if config.api_src_dir not in sys.path:
+        sys.path.insert(0, config.api_src_dir)
+
+
+@pytest.fixture(scope="function")
+def repository_queries():
+    """Repository of the API sources on the test database and the SQL it has executed."""
+    import_api_sources()
+    from repository.repository import Repositiry
+
+    engine = create_engine(
+        "postgresql://{0}:{1}@{2}:{3}/{4}".format(
+            config.pg_user, config.pg_password, config.pg_host, config.pg_port, config.pg_db
+        )
+    )
+    queries = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        queries.append((statement, parameters))
+
+    @contextmanager
+    def session_factory(write: bool = False):
+        with Session(engine) as session:
+            yield session
+
+    yield Repositiry(session_factory), queries
+    engine.dispose()
+
+
+@pytest.fixture(scope="function")
+def request_database():
+    """Database of the API sources and a Flask app sharing its session within each request."""
+    import_api_sources()
+    from db.db import Database, configure_request_session
+    from flask import Flask
+
+    database = Database()
+    app = Flask(__name__)
+    configure_request_session(app, database)
+    yield database, app
+    database.engine.dispose()
@@ -23,3 +23,20 @@ async def get_from_redis(redis_client):
         return await redis_client.get(key)
 
     return inner
+
+
+@pytest_asyncio.fixture(scope="session")
+async def revocations_redis_client():
+    client = await aioredis.from_url(
+        "redis://{0}:{1}".format(config.redis_host, config.redis_port), db=3, decode_responses=True
+    )
+    yield client
+    await client.close()
+
+
+@pytest_asyncio.fixture
+async def get_revocations_ttl(revocations_redis_client):
+    async def inner(key: str):
+        return await revocations_redis_client.ttl(key)
+
+    return inner
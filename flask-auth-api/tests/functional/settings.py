@@ -13,5 +13,11 @@ class ConfigSettings(BaseSettings):
     pg_password: str = Field("123qwe", env="PG_PASSWORD")
     pg_db: str = Field("users", env="PG_DB")
 
+    refresh_ttl: int = Field(60 * 60 * 24, env="REFRESH_TTL")
+    access_history_flush_interval: float = Field(1.0, env="ACCESS_HISTORY_FLUSH_INTERVAL")
+
+    # the tests image is built from the auth image, the API sources are there
+    api_src_dir: str = Field("/code", env="API_SRC_DIR")
+
 
 config = ConfigSettings()
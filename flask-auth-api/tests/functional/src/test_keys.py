@@ -0,0 +1,19 @@
+from http import HTTPStatus
+
+import pytest
+from settings import config
+
+url = f"http://{config.api_ip}:{config.api_port}/.well-known/jwks.json"
+
+
+@pytest.mark.asyncio
+async def test_jwks(make_get_request, make_get_request_no_body):
+
+    response = await make_get_request(url=url)
+    assert response.status == HTTPStatus.OK
+    assert "keys" in response.body
+    assert "max-age" in response.headers["Cache-Control"]
+
+    # unchanged key set is served from client cache
+    response = await make_get_request_no_body(url=url, headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status == HTTPStatus.NOT_MODIFIED
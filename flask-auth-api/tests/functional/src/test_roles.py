@@ -1,10 +1,11 @@
 from http import HTTPStatus
 from time import sleep
 
+import jwt
 import pytest
 from settings import config
 from testdata.roles import role_data, update_role_data
-from testdata.users import user_data
+from testdata.users import update_user_data, user_data
 
 url_users = f"http://{config.api_ip}:{config.api_port}/api/v1/users"
 url = f"http://{config.api_ip}:{config.api_port}/api/v1/roles"
@@ -30,6 +31,25 @@ async def test_create_roles(clear_db_tables, clear_redis, insert_roles):
     assert response.status == HTTPStatus.CREATED
 
 
+@pytest.mark.asyncio
+async def test_create_roles_conflict(make_get_request, make_post_request, clear_db_tables, clear_redis, insert_roles):
+
+    response, headers_access = await insert_roles()
+    assert response.status == HTTPStatus.CREATED
+
+    # add new role together with existing one and duplicated new one
+    new_role = {"role": "role4", "description": "description4"}
+    response = await make_post_request(
+        url=f"{url}/", headers=headers_access, data=[new_role, role_data[0], new_role]
+    )
+    assert response.status == HTTPStatus.CONFLICT
+    assert response.body["conflicts"] == [role_data[0]["role"], new_role["role"]]
+
+    # check that nothing is created
+    response = await make_get_request(url=f"{url}/", headers=headers_access)
+    assert len(response.body) == len(role_data)
+
+
 @pytest.mark.asyncio
 async def test_get_roles(make_get_request, clear_db_tables, clear_redis, insert_roles):
 
@@ -157,6 +177,95 @@ async def test_add_user_role(
     assert response.status == HTTPStatus.OK
 
 
+@pytest.mark.asyncio
+async def test_add_many_user_roles(
+    make_delete_request, clear_db_tables, clear_redis, insert_roles, make_get_request, prepare_user, make_post_request
+):
+
+    response, headers_access = await insert_roles()
+    assert response.status == HTTPStatus.CREATED
+
+    # get all role_ids
+    response = await make_get_request(url=f"{url}/", headers=headers_access)
+    role_ids = [role["id"] for role in response.body]
+
+    # get uuid for normal user to add roles to
+    _, _, uuid = await prepare_user(url_users, user_data[3][0])
+
+    # add all roles, then add them again
+    for _ in range(2):
+        response = await make_post_request(
+            url=f"{url}/user/{uuid}", headers=headers_access, data={"role_id": role_ids}
+        )
+        assert response.status == HTTPStatus.OK
+
+    # add existing and not existing roles
+    response = await make_post_request(
+        url=f"{url}/user/{uuid}",
+        headers=headers_access,
+        data={"role_id": [role_ids[0], "0774bba8-e050-40d0-a490-2a1c6fe33472"]},
+    )
+    assert response.status == HTTPStatus.NOT_FOUND
+
+    # delete all roles, a malformed role id is skipped
+    response = await make_delete_request(
+        url=f"{url}/user/{uuid}", headers=headers_access, data={"role_id": role_ids + ["not-a-uuid"]}
+    )
+    assert response.status == HTTPStatus.OK
+    headers_access_user, _, _ = await prepare_user(url_users, user_data[3][0])
+    access_token = headers_access_user["Authorization"].split()[1]
+    assert jwt.decode(access_token, options={"verify_signature": False})["roles"] == []
+
+
+@pytest.mark.asyncio
+async def test_bulk_user_roles(
+    make_delete_request,
+    clear_db_tables,
+    clear_redis,
+    insert_roles,
+    make_get_request,
+    prepare_user,
+    make_post_request,
+    get_revocations_ttl,
+):
+
+    response, headers_access = await insert_roles()
+    assert response.status == HTTPStatus.CREATED
+
+    # get all role_ids
+    response = await make_get_request(url=f"{url}/", headers=headers_access)
+    role_ids = [role["id"] for role in response.body]
+
+    # get uuids for normal users to add roles to
+    user_ids = [(await prepare_user(url_users, data))[2] for data in (user_data[3][0], update_user_data)]
+    bulk_data = {"user_id": user_ids + ["0774bba8-e050-40d0-a490-2a1c6fe33472"], "role_id": role_ids}
+
+    # add roles to many users, then add them again
+    response = await make_post_request(url=f"{url}/users", headers=headers_access, data=bulk_data)
+    assert response.status == HTTPStatus.OK
+    assert response.body == {"users": 3, "updated": 2}
+    # only users whose roles changed get their tokens revoked, the unknown id gets no epoch
+    for user_id in user_ids:
+        assert await get_revocations_ttl(f"epoch:{user_id}") > 0
+    assert await get_revocations_ttl("epoch:0774bba8-e050-40d0-a490-2a1c6fe33472") == -2
+    response = await make_post_request(url=f"{url}/users", headers=headers_access, data=bulk_data)
+    assert response.status == HTTPStatus.OK
+    assert response.body == {"users": 3, "updated": 0}
+
+    # add not existing role
+    response = await make_post_request(
+        url=f"{url}/users",
+        headers=headers_access,
+        data={"user_id": user_ids, "role_id": ["0774bba8-e050-40d0-a490-2a1c6fe33472"]},
+    )
+    assert response.status == HTTPStatus.NOT_FOUND
+
+    # remove roles from many users
+    response = await make_delete_request(url=f"{url}/users", headers=headers_access, data=bulk_data)
+    assert response.status == HTTPStatus.OK
+    assert response.body == {"users": 3, "updated": 2}
+
+
 @pytest.mark.asyncio
 async def test_add_user_role_not_superuser(
     make_delete_request, clear_db_tables, clear_redis, insert_roles, make_get_request, prepare_user, make_post_request
@@ -316,3 +425,90 @@ async def test_delete_role_assigned_to_user(
     # delete by superuser role
     response = await make_delete_request(url=f"{url}/{role_id}", headers=headers_access)
     assert response.status == HTTPStatus.OK
+
+
+@pytest.mark.asyncio
+async def test_update_role_assigned_to_user(
+    make_put_request, clear_db_tables, clear_redis, insert_roles, make_get_request, prepare_user, make_post_request
+):
+
+    # create roles and get superuser access_token
+    response, headers_access = await insert_roles()
+    assert response.status == HTTPStatus.CREATED
+
+    # get created role_id
+    response = await make_get_request(url=f"{url}/", headers=headers_access)
+    role_id = response.body[0]["id"]
+
+    # add role to user with superuser and login to cache user roles
+    _, _, uuid = await prepare_user(url_users, user_data[3][0])
+    response = await make_post_request(url=f"{url}/user/{uuid}", headers=headers_access, data={"role_id": [role_id]})
+    assert response.status == HTTPStatus.OK
+    await prepare_user(url_users, user_data[3][0])
+
+    # rename role by superuser
+    response = await make_put_request(url=f"{url}/{role_id}", headers=headers_access, data=update_role_data)
+    assert response.status == HTTPStatus.OK
+
+    # check that new user access_token has renamed role
+    headers_access_user, _, _ = await prepare_user(url_users, user_data[3][0])
+    response = await make_post_request(
+        url=f"{url}/user/check",
+        headers=headers_access,
+        data={"access_token": headers_access_user["Authorization"].replace("Bearer ", "")},
+    )
+    assert response.status == HTTPStatus.OK
+    assert response.body == [update_role_data["role"]]
+
+
+@pytest.mark.asyncio
+async def test_check_user_role_batch(clear_db_tables, clear_redis, insert_roles, prepare_user, make_post_request):
+
+    # create roles and get superuser access_token
+    response, headers_access = await insert_roles()
+    assert response.status == HTTPStatus.CREATED
+
+    # get access_token for normal user
+    headers_access_user, _, _ = await prepare_user(url_users, user_data[3][0])
+
+    # check valid and malformed tokens in one request
+    response = await make_post_request(
+        url=f"{url}/user/check/batch",
+        headers=headers_access,
+        data={"access_tokens": [headers_access_user["Authorization"].replace("Bearer ", ""), "not a token"]},
+    )
+    assert response.status == HTTPStatus.OK
+    assert [check["status"] for check in response.body] == ["valid", "invalid"]
+
+
+def test_after_commit_survives_retried_read(clear_db_tables, request_database):
+    from db.db import after_commit
+    from models.db_models import Role
+    from repository.repository import Repositiry
+    from sqlalchemy import event
+    from sqlalchemy.exc import OperationalError
+
+    database, app = request_database
+    repository = Repositiry(database.session_manager)
+    failures = []
+    invalidated = []
+
+    @event.listens_for(database.engine, "before_cursor_execute")
+    def fail_once(conn, cursor, statement, parameters, context, executemany):
+        if failures and statement.lstrip().upper().startswith("SELECT"):
+            raise failures.pop()
+
+    @app.route("/")
+    def write_then_read():
+        assert repository.create_obj_in_db(Role("reader", "can read"))
+        after_commit(lambda: invalidated.append("reader"))
+        failures.append(OperationalError("SELECT", {}, Exception("canceling statement due to statement timeout")))
+        assert len(repository.get_objects_by_field(Role)) == 1
+        return "ok"
+
+    response = app.test_client().get("/")
+
+    # the read is retried within the request's transaction, the write and its callback are kept
+    assert response.status_code == HTTPStatus.OK
+    assert invalidated == ["reader"]
+    assert len(repository.get_objects_by_field(Role)) == 1
@@ -1,11 +1,16 @@
+import csv
+import io
+import json
 from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
+from uuid import uuid4
 
 import jwt
 import pyotp
 import pytest
 from settings import config
-from testdata.users import update_user_data, user_data, user_login
+from testdata.users import imported_users, update_user_data, user_data, user_login
 
 url = f"http://{config.api_ip}:{config.api_port}/api/v1/users"
 totp_url = f"http://{config.api_ip}:{config.api_port}/api/v1/totp"
@@ -18,6 +23,14 @@ class Header:
     uuid: str
 
 
+def imported_users_csv() -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(imported_users[0]))
+    writer.writeheader()
+    writer.writerows(imported_users)
+    return buffer.getvalue()
+
+
 async def check_tokens(response, func):
     refresh_token = response.body["refresh_token"]
     decoded_refresh_token = jwt.decode(refresh_token, options={"verify_signature": False})
@@ -61,7 +74,7 @@ async def test_refresh(make_get_request, clear_db_tables, clear_redis, get_from_
 
 
 @pytest.mark.asyncio
-async def test_logout(make_get_request, clear_db_tables, clear_redis, prepare_user):
+async def test_logout(make_get_request, clear_db_tables, clear_redis, prepare_user, wait_for_history):
 
     headers = []
 
@@ -71,6 +84,7 @@ async def test_logout(make_get_request, clear_db_tables, clear_redis, prepare_us
         headers.append(Header(headers_access, headers_refresh, uuid))
 
     uuid = headers[0].uuid
+    await wait_for_history()
 
     # logout only one user device
     response = await make_get_request(url=f"{url}/logout/{uuid}?all_devices=false", headers=headers[0].header_access)
@@ -110,6 +124,25 @@ async def test_logout_all(make_get_request, clear_db_tables, clear_redis, prepar
         assert response.status == HTTPStatus.UNAUTHORIZED
 
 
+@pytest.mark.asyncio
+async def test_logout_all_epoch_expires(
+    make_get_request, clear_db_tables, clear_redis, prepare_user, get_revocations_ttl, wait_for_history
+):
+    headers_access, _, uuid = await prepare_user(url, user_data[0][0])
+
+    response = await make_get_request(url=f"{url}/logout/{uuid}?all_devices=true", headers=headers_access)
+    assert response.status == HTTPStatus.OK
+
+    # the epoch outlives every token it revokes and no longer
+    assert 0 < await get_revocations_ttl(f"epoch:{uuid}") <= config.refresh_ttl
+
+    # a new login after the revocation is not revoked by it
+    headers_access, _, _ = await prepare_user(url, user_data[0][0])
+    await wait_for_history()
+    response = await make_get_request(url=f"{url}/history/{uuid}", headers=headers_access)
+    assert response.status == HTTPStatus.OK
+
+
 @pytest.mark.asyncio
 async def test_user_change(
     make_post_request, make_put_request, clear_db_tables, clear_redis, get_from_redis, prepare_user
@@ -127,9 +160,10 @@ async def test_user_change(
 
 
 @pytest.mark.asyncio
-async def test_user_history(make_get_request, clear_db_tables, clear_redis, prepare_user):
+async def test_user_history(make_get_request, clear_db_tables, clear_redis, prepare_user, wait_for_history):
 
     headers_access, _, uuid = await prepare_user(url, user_data[0][0])
+    await wait_for_history()
 
     response = await make_get_request(url=f"{url}/history/{uuid}?page_num=1&page_items=5", headers=headers_access)
 
@@ -137,6 +171,101 @@ async def test_user_history(make_get_request, clear_db_tables, clear_redis, prep
     assert len(response.body) == 1
 
 
+@pytest.mark.asyncio
+async def test_user_history_cursor(
+    make_get_request, make_post_request, clear_db_tables, clear_redis, prepare_user, wait_for_history
+):
+
+    headers_access, _, uuid = await prepare_user(url, user_data[0][0])
+    await make_post_request(url=f"{url}/login", data=user_data[0][0])
+    await wait_for_history()
+
+    response = await make_get_request(url=f"{url}/history/{uuid}?page_items=1", headers=headers_access)
+    assert response.status == HTTPStatus.OK
+    assert len(response.body) == 1
+    first_page = response.body
+
+    response = await make_get_request(
+        url=f"{url}/history/{uuid}?page_items=1&cursor={response.headers['X-Next-Cursor']}", headers=headers_access
+    )
+    assert response.status == HTTPStatus.OK
+    assert len(response.body) == 1
+    assert response.body != first_page
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_user_history_range(make_get_request, clear_db_tables, clear_redis, prepare_user, wait_for_history):
+
+    headers_access, _, uuid = await prepare_user(url, user_data[0][0])
+    await wait_for_history()
+    now = datetime.now(timezone.utc)
+
+    params = {"from": (now - timedelta(hours=1)).isoformat(), "to": (now + timedelta(hours=1)).isoformat()}
+    response = await make_get_request(url=f"{url}/history/{uuid}", params=params, headers=headers_access)
+    assert response.status == HTTPStatus.OK
+    assert len(response.body) == 1
+
+    params = {"from": (now - timedelta(days=2)).isoformat(), "to": (now - timedelta(days=1)).isoformat()}
+    response = await make_get_request(url=f"{url}/history/{uuid}", params=params, headers=headers_access)
+    assert response.status == HTTPStatus.NOT_FOUND
+
+    response = await make_get_request(
+        url=f"{url}/history/{uuid}", params={"year": 9999, "month": 12}, headers=headers_access
+    )
+    assert response.status == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_user_history_export(
+    make_get_request_text, make_post_request, clear_db_tables, clear_redis, prepare_user, wait_for_history
+):
+
+    headers_access, _, uuid = await prepare_user(url, user_data[0][0])
+    for _ in range(2):
+        await make_post_request(url=f"{url}/login", data=user_data[0][0])
+    await make_post_request(url=f"{url}/login", data={**user_data[0][0], "password": "wrong"})
+    await wait_for_history()
+
+    response = await make_get_request_text(url=f"{url}/history/export/{uuid}?format=ndjson", headers=headers_access)
+    assert response.status == HTTPStatus.OK
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.body.splitlines()]
+    assert [row["login_status"] for row in rows] == [True, True, True, False]
+    assert all(set(row) == {"id", "user_id", "user_agent", "login_date", "login_status"} for row in rows)
+    assert {row["user_id"] for row in rows} == {uuid}
+    assert [row["login_date"] for row in rows] == sorted(row["login_date"] for row in rows)
+
+    response = await make_get_request_text(url=f"{url}/history/export/{uuid}?format=csv", headers=headers_access)
+    assert response.status == HTTPStatus.OK
+    assert response.headers["Content-Type"].startswith("text/csv")
+    reader = csv.DictReader(io.StringIO(response.body))
+    assert reader.fieldnames == ["id", "user_id", "user_agent", "login_date", "login_status"]
+    assert [row["id"] for row in reader] == [row["id"] for row in rows]
+
+    params = {"format": "ndjson", "from": rows[2]["login_date"]}
+    response = await make_get_request_text(url=f"{url}/history/export/{uuid}", params=params, headers=headers_access)
+    assert [json.loads(line)["id"] for line in response.body.splitlines()] == [row["id"] for row in rows[2:]]
+
+    params = {"format": "csv", "to": rows[2]["login_date"]}
+    response = await make_get_request_text(url=f"{url}/history/export/{uuid}", params=params, headers=headers_access)
+    assert [row["id"] for row in csv.DictReader(io.StringIO(response.body))] == [row["id"] for row in rows[:2]]
+
+
+def test_user_history_partition_pruning(explain, repository_queries):
+    from services.users import HistoryUserService
+
+    repository, queries = repository_queries
+    month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+
+    history_service = HistoryUserService(repository=repository, cache=None, history_writer=None)
+    history_service._get_user_history_from_db(str(uuid4()), 0, 20, month_start, next_month_start, None)
+
+    relations = explain(*queries[-1])
+    assert relations == {"users_access_history_y{0}m{1}".format(month_start.year, month_start.month)}
+
+
 @pytest.mark.asyncio
 async def test_superuser_change_normal_user(
     make_post_request, make_put_request, clear_db_tables, clear_redis, prepare_user, make_superuser, get_from_redis
@@ -159,6 +288,36 @@ async def test_superuser_change_normal_user(
     assert response.status == HTTPStatus.OK
 
 
+@pytest.mark.asyncio
+async def test_login_stats(
+    make_get_request, make_post_request, clear_db_tables, clear_redis, prepare_user, make_superuser, wait_for_history
+):
+
+    _, _, uuid_normal = await prepare_user(url, user_data[0][0])
+    await make_post_request(url=f"{url}/login", data={**user_data[0][0], "password": "wrong"})
+
+    _, _, uuid_super = await prepare_user(url, user_data[3][0])
+    make_superuser(uuid_super)
+    headers_access_super, _, _ = await prepare_user(url, user_data[3][0])
+    await wait_for_history()
+
+    params = {"granularity": "provider", "user_id": uuid_normal, "login_status": "false"}
+    response = await make_get_request(url=f"{url}/stats", params=params, headers=headers_access_super)
+    assert response.status == HTTPStatus.OK
+    assert response.body == [{"service_name": "password", "login_status": False, "count": 1}]
+
+    params = {"granularity": "provider", "group_by": "user_id", "login_status": "true"}
+    response = await make_get_request(url=f"{url}/stats", params=params, headers=headers_access_super)
+    assert response.status == HTTPStatus.OK
+    assert sorted(response.body, key=lambda stat: stat["user_id"]) == sorted(
+        [
+            {"user_id": uuid_normal, "service_name": "password", "login_status": True, "count": 1},
+            {"user_id": uuid_super, "service_name": "password", "login_status": True, "count": 2},
+        ],
+        key=lambda stat: stat["user_id"],
+    )
+
+
 @pytest.mark.asyncio
 async def test_normal_user_change_normal_user(
     make_post_request, make_put_request, clear_db_tables, clear_redis, prepare_user
@@ -204,6 +363,29 @@ async def test_login_social_existing_user(make_get_request, clear_db_tables, cle
     assert response.status == HTTPStatus.OK
 
 
+def test_login_social_user_single_query(clear_db_tables, repository_queries):
+    from models.db_models import Role, SocialAccount, User
+    from services.users import ManageSocialUserService
+    from social.userdata import UserData
+
+    repository, queries = repository_queries
+    user = User(login="social_user", password="password")
+    user.roles.extend([Role("reader", "can read"), Role("writer", "can write")])
+    user.social_accounts.append(SocialAccount(social_id="42", social_name="yandex"))
+    assert repository.create_obj_in_db(user)
+    queries.clear()
+
+    social_service = ManageSocialUserService(repository=repository, cache=None, history_writer=None)
+    found, roles = social_service._get_social_user(
+        UserData(social_id="42", social_service="yandex", user_email="social@example.com")
+    )
+
+    # the user and the role names come from one statement
+    assert len(queries) == 1
+    assert found.login == "social_user"
+    assert sorted(roles) == ["reader", "writer"]
+
+
 @pytest.mark.asyncio
 async def test_delete_social_user_without_token(make_get_request, make_delete_request, clear_db_tables, clear_redis):
 
@@ -279,3 +461,57 @@ async def test_register_rate_limitter(make_post_request, clear_db_tables, clear_
         assert response.status != HTTPStatus.TOO_MANY_REQUESTS
     response = await make_post_request(url=f"{url}/register", data=user_data[0][0])
     assert response.status == HTTPStatus.TOO_MANY_REQUESTS
+
+
+@pytest.mark.asyncio
+async def test_import_export_users(run_flask_command, make_post_request, clear_db_tables, clear_redis):
+
+    result = run_flask_command("users", "import", "--format", "csv", input_data=imported_users_csv())
+    assert "Row 3 rejected" in result.stderr
+    assert "3 rows read, 2 inserted, 1 rejected" in result.stderr
+
+    response = await make_post_request(url=f"{url}/login", data={"login": "current", "password": "password2"})
+    assert response.status == HTTPStatus.OK
+
+    result = run_flask_command("users", "export", "--format", "ndjson")
+    exported = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [user["id"] for user in exported] == sorted(user["id"] for user in imported_users[:2])
+    assert exported[0] == {**imported_users[0], "is_superuser": False}
+    assert exported[1] == {**imported_users[1], "email": None, "is_superuser": True}
+
+    result = run_flask_command("users", "export", "--format", "csv")
+    assert list(csv.DictReader(io.StringIO(result.stdout))) == [
+        {**imported_users[0], "is_superuser": "f"},
+        {**imported_users[1], "is_superuser": "t"},
+    ]
+    result = run_flask_command("users", "import", "--format", "csv", input_data=result.stdout)
+    assert "2 rows read, 0 inserted, 0 rejected" in result.stderr
+
+
+@pytest.mark.asyncio
+async def test_login_rehashes_legacy_password(
+    run_flask_command, make_post_request, fetch_from_db, clear_db_tables, clear_redis
+):
+
+    run_flask_command("users", "import", "--format", "csv", input_data=imported_users_csv())
+    legacy_user = {"login": "legacy", "password": "password1"}
+
+    response = await make_post_request(url=f"{url}/login", data=legacy_user)
+    assert response.status == HTTPStatus.OK
+    rows = fetch_from_db("SELECT password FROM users WHERE login = %(login)s", {"login": "legacy"})
+    assert rows[0]["password"].startswith("$2b$")
+
+    response = await make_post_request(url=f"{url}/login", data=legacy_user)
+    assert response.status == HTTPStatus.OK
+
+
+@pytest.mark.asyncio
+async def test_login_rate_limitter_per_ip(make_post_request, clear_db_tables, clear_redis):
+
+    # every login has its own bucket, the client's IP bucket is shared by all of them
+    for number in range(10):
+        login_data = {"login": f"user{number}", "password": "password1"}
+        response = await make_post_request(url=f"{url}/login", data=login_data)
+        assert response.status != HTTPStatus.TOO_MANY_REQUESTS
+    response = await make_post_request(url=f"{url}/login", data={"login": "user10", "password": "password1"})
+    assert response.status == HTTPStatus.TOO_MANY_REQUESTS
@@ -34,3 +34,30 @@ user_login = (
     ),
 )
 update_user_data = {"login": "user2", "password": "password2"}
+
+# hashes of "password1" and "password2", imported users keep them
+md5_crypt_hash = "$1$M/gVjmSf$j0g3.e1W2JEMT7oaxXrY1/"
+bcrypt_hash = "$2b$12$DgtMLBcWbWF3SRbUt9BSZeYfdd3.kcfzZXHOabBdmWrMEnA1xBxtC"
+imported_users = (
+    {
+        "id": "5f0f7e6c-2f5a-4c1b-9a57-3f4f5b3f3a01",
+        "login": "legacy",
+        "password": md5_crypt_hash,
+        "email": "legacy@example.com",
+        "is_superuser": "false",
+    },
+    {
+        "id": "5f0f7e6c-2f5a-4c1b-9a57-3f4f5b3f3a02",
+        "login": "current",
+        "password": bcrypt_hash,
+        "email": "",
+        "is_superuser": "true",
+    },
+    {
+        "id": "5f0f7e6c-2f5a-4c1b-9a57-3f4f5b3f3a03",
+        "login": "broken",
+        "password": bcrypt_hash[:-3],
+        "email": "",
+        "is_superuser": "false",
+    },
+)